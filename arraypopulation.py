@@ -0,0 +1,360 @@
+##
+#   Array backed population storage. Holds every resident of a town as a set
+#   of contiguous NumPy columns so whole-town operations (stepping, taxes,
+#   happiness, voting) can be done as vector math instead of object walks.
+#   Preferences and unbendable masks are (people, words) arrays of packed 64
+#   bit words, so platforms can be as wide as needed.
+##
+
+import numpy as np
+
+from happiness import WORD_BITS, check_happiness_batch, pack_words, popcount, unpack_word, words_for
+from simulationobjects import IDManager, Person
+
+
+# Column name -> dtype for everything we store per resident
+COLUMNS = {
+    "ids": np.int64,
+    "preference_base_bits": np.uint64,
+    "unbendable_bitmask": np.uint64,
+    "basically_happy": np.bool_,
+    "move_threshold": np.float64,
+    "money": np.float64,
+    "seniority": np.float64,
+    "earned_ytd": np.float64,
+}
+
+# Columns holding a packed bitset, a row of words per resident
+BITSET_COLUMNS = ("preference_base_bits", "unbendable_bitmask")
+
+
+def _unpack_bits_(words):
+    """Every bit of rows of packed words as 0/1 bytes, lowest bit first."""
+    return np.unpackbits(np.ascontiguousarray(words, dtype="<u8").view(np.uint8), axis=-1, bitorder="little")
+
+
+def count_vote_bits(preference_bits, preference_width: int, chunk_bytes: int = 1 << 24, weights=None):
+    """Number of preferences with each platform bit set, each counted weights times if given.
+
+    Takes packed word rows, a flat array of single words, or a list of ints.
+    """
+    words = words_for(preference_width)
+
+    if isinstance(preference_bits, np.ndarray):
+        preference_bits = preference_bits.astype(np.uint64, copy=False).reshape(len(preference_bits), words)
+    else:
+        preference_bits = pack_words(preference_bits, words)
+
+    tally = np.zeros(words * WORD_BITS, dtype=np.int64)
+    # Unpacking takes a byte per bit, so do it a bounded number of rows at a time
+    chunk_rows = max(1, chunk_bytes // (words * WORD_BITS))
+
+    for start in range(0, len(preference_bits), chunk_rows):
+        bits = _unpack_bits_(preference_bits[start:start + chunk_rows])
+
+        if weights is None:
+            tally += bits.sum(axis=0, dtype=np.int64)
+        else:
+            tally += (bits * np.asarray(weights[start:start + chunk_rows], dtype=np.int64)[:, np.newaxis]).sum(axis=0)
+
+    return tally[:preference_width]
+
+
+def generate_columns(count: int, preference_width: int, rng: np.random.Generator, chunk_size: int = 65536):
+    """Draw a whole population's columns at once, distributed the same as Person and Town draw them."""
+    words = words_for(preference_width)
+    # Full 64 bit draws with the top word cut down to the bits left over, same as getrandbits
+    preference_base_bits = rng.bit_generator.random_raw(count * words).reshape(count, words)
+    preference_base_bits[:, -1] >>= np.uint64(words * WORD_BITS - preference_width)
+    hardheadedness = rng.integers(0, preference_width, size=count)
+    unbendable_bitmask = np.zeros((count, words), dtype=np.uint64)
+    # Keep the rank matrix about chunk_size 64 bit rows big however wide platforms get
+    chunk_rows = max(1, chunk_size * WORD_BITS // max(preference_width, WORD_BITS))
+
+    # Picking hardheadedness distinct bits is taking the lowest ranked bits of
+    # a random ordering, done in chunks to keep the rank matrix small
+    for start in range(0, count, chunk_rows):
+        stop = min(start + chunk_rows, count)
+        ranks = rng.random((stop - start, preference_width), dtype=np.float32).argsort(axis=1).argsort(axis=1)
+        chosen = ranks < hardheadedness[start:stop, np.newaxis]
+        packed = np.zeros((stop - start, words * 8), dtype=np.uint8)
+        packed[:, :(preference_width + 7) // 8] = np.packbits(chosen, axis=1, bitorder="little")
+        unbendable_bitmask[start:stop] = packed.view("<u8")
+
+    return {
+        "ids": np.array(IDManager.getNewIDs(count), dtype=np.int64),
+        "preference_base_bits": preference_base_bits,
+        "unbendable_bitmask": unbendable_bitmask,
+        "basically_happy": rng.integers(0, 2, size=count).astype(np.bool_),
+        "move_threshold": rng.integers(40, 61, size=count) / 100,
+        "money": np.zeros(count, dtype=np.float64),
+        "seniority": rng.integers(0, 26, size=count) / 100,
+        "earned_ytd": np.zeros(count, dtype=np.float64),
+    }
+
+
+def generate_population(count: int, preference_width: int, rng: np.random.Generator, town_id: int = None):
+    population = ArrayPopulation(preference_width, town_id, count)
+    population.extend(generate_columns(count, preference_width, rng))
+
+    return population
+
+
+def _column_property(name: str):
+    def getter(self):
+        return self._columns[name][:self.size]
+
+    def setter(self, value):
+        self._columns[name][:self.size] = value
+
+    return property(getter, setter)
+
+
+class ColumnPopulation:
+    """What array and cohort backed populations share, a row per resident or per cohort.
+
+    Subclasses list their columns in COLUMNS and keep size, total_money and
+    vote_tally up to date as rows come and go.
+    """
+
+    COLUMNS = {}
+
+    def __init__(self, preference_width: int, town_id: int = None, capacity: int = 16):
+        self.preference_width = preference_width
+        self.words = words_for(preference_width)
+        # Which town these people live in, used to tell returning movers from new arrivals
+        self.town_id = town_id
+        # Rows in use
+        self.size = 0
+        # Running sum of the money column, kept up to date by every change below
+        self.total_money = 0
+        # Residents voting for each platform bit, kept up to date like total_money
+        self.vote_tally = np.zeros(preference_width, dtype=np.int64)
+        self._columns = {name: np.zeros(self._column_shape_(name, max(capacity, 1)), dtype=dtype) for name, dtype in self.COLUMNS.items()}
+
+    def _column_shape_(self, name: str, rows: int):
+        return (rows, self.words) if name in BITSET_COLUMNS else (rows,)
+
+    @property
+    def capacity(self):
+        return len(self._columns["money"])
+
+    def _reserve_(self, needed: int):
+        if needed <= self.capacity:
+            return
+
+        new_capacity = self.capacity
+        while new_capacity < needed:
+            new_capacity *= 2
+
+        for name, column in self._columns.items():
+            grown = np.zeros(self._column_shape_(name, new_capacity), dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            self._columns[name] = grown
+
+    def take(self, mask: np.ndarray):
+        """Remove the rows selected by mask and hand them back as their own population."""
+        rows = int(np.count_nonzero(mask))
+        taken = type(self)(self.preference_width, self.town_id, rows)
+        keep = ~mask
+
+        for name, column in self._columns.items():
+            live = column[:self.size]
+            taken._columns[name][:rows] = live[mask]
+            column[:self.size - rows] = live[keep]
+
+        taken.size = rows
+        taken.total_money = float(taken.money.sum())
+        self.size -= rows
+        self.total_money -= taken.total_money
+        taken.vote_tally = taken.recount_votes()
+        self.vote_tally -= taken.vote_tally
+
+        return taken
+
+    def adjust_money(self, amounts: np.ndarray):
+        """Add amounts to each row's money."""
+        self.money += amounts
+        self.total_money += float(amounts.sum())
+
+    def check_happiness(self, environment_values):
+        """Happiness of every row against one platform, or a row per platform if given several."""
+        return check_happiness_batch(self.preference_base_bits, self.unbendable_bitmask, self.basically_happy, self.preference_width, environment_values)
+
+    def is_happy(self, environment_value: int):
+        return (self.check_happiness(environment_value) / self.preference_width) > self.move_threshold
+
+    def recount_votes(self):
+        """Full recount of vote_tally from the preference column."""
+        return count_vote_bits(self.preference_base_bits, self.preference_width, weights=self.counts)
+
+
+class ArrayPopulation(ColumnPopulation):
+    COLUMNS = COLUMNS
+
+    ids = _column_property("ids")
+    preference_base_bits = _column_property("preference_base_bits")
+    unbendable_bitmask = _column_property("unbendable_bitmask")
+    basically_happy = _column_property("basically_happy")
+    move_threshold = _column_property("move_threshold")
+    money = _column_property("money")
+    seniority = _column_property("seniority")
+    earned_ytd = _column_property("earned_ytd")
+
+    @property
+    def counts(self):
+        """Residents per row, always one."""
+        return np.ones(self.size, dtype=np.int64)
+
+    @property
+    def average_money(self):
+        return self.money
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for slot in range(self.size):
+            yield PersonView(self, slot)
+
+    def __getitem__(self, slot: int):
+        if slot < 0 or slot >= self.size:
+            raise IndexError(slot)
+
+        return PersonView(self, slot)
+
+    def append(self, person: Person, seniority: float = 0, earned_ytd: float = 0):
+        # People coming back from our own mover batch keep their standing here
+        if isinstance(person, PersonView) and person.population.town_id == self.town_id:
+            seniority = person.seniority
+            earned_ytd = person.earned_ytd
+
+        self._reserve_(self.size + 1)
+        slot = self.size
+        columns = self._columns
+
+        columns["ids"][slot] = person.id
+        columns["preference_base_bits"][slot] = pack_words([person.preference_base_bits], self.words)[0]
+        columns["unbendable_bitmask"][slot] = pack_words([person.unbendable_bitmask], self.words)[0]
+        columns["basically_happy"][slot] = person.basically_happy
+        columns["move_threshold"][slot] = person.move_threshold
+        columns["money"][slot] = person.money
+        columns["seniority"][slot] = seniority
+        columns["earned_ytd"][slot] = earned_ytd
+        self.size += 1
+        self.total_money += float(columns["money"][slot])
+        self.vote_tally += _unpack_bits_(columns["preference_base_bits"][slot])[:self.preference_width]
+
+        return slot
+
+    def extend(self, columns: dict):
+        """Bulk append rows given as one array per column, bitsets may be flat up to 64 bits."""
+        count = len(columns["ids"])
+        self._reserve_(self.size + count)
+
+        for name, column in self._columns.items():
+            column[self.size:self.size + count] = np.reshape(columns[name], self._column_shape_(name, count))
+
+        self.size += count
+        self.total_money += float(np.sum(columns["money"]))
+        self.vote_tally += count_vote_bits(columns["preference_base_bits"], self.preference_width)
+
+    def extend_population(self, other: "ArrayPopulation"):
+        """Move everyone in other in here, keeping their standing only if other came from this town."""
+        columns = {name: getattr(other, name) for name in COLUMNS}
+
+        # Same as append() does for newcomers one at a time
+        if other.town_id != self.town_id:
+            columns["seniority"] = np.zeros(other.size)
+            columns["earned_ytd"] = np.zeros(other.size)
+
+        self.extend(columns)
+
+    def slot_of(self, id: int):
+        slots = np.flatnonzero(self.ids == id)
+
+        return int(slots[0]) if len(slots) else None
+
+    def get(self, id: int):
+        slot = self.slot_of(id)
+
+        return None if slot is None else PersonView(self, slot)
+
+    def remove(self, person: Person):
+        slot = self.slot_of(person.id)
+
+        if slot is None:
+            raise ValueError(f"Person {person.id} is not in this population")
+
+        keep = np.ones(self.size, dtype=np.bool_)
+        keep[slot] = False
+        self.take(~keep)
+
+    def recount_votes(self):
+        """Full recount of vote_tally from the preference column, every row is one vote."""
+        return count_vote_bits(self.preference_base_bits, self.preference_width)
+
+
+class PersonView(Person):
+    """Lightweight Person that reads and writes a single row of an ArrayPopulation.
+
+    Views index by slot, so they should not be held across removals from the
+    population they point into.
+    """
+
+    __slots__ = ("population", "slot")
+
+    def __init__(self, population: ArrayPopulation, slot: int):
+        self.population = population
+        self.slot = slot
+
+    def _get_(self, name: str):
+        return self.population._columns[name][self.slot]
+
+    def _set_(self, name: str, value):
+        self.population._columns[name][self.slot] = value
+
+    @property
+    def id(self):
+        return int(self._get_("ids"))
+
+    @property
+    def preference_width(self):
+        return self.population.preference_width
+
+    @property
+    def preference_base_bits(self):
+        return unpack_word(self._get_("preference_base_bits"))
+
+    @property
+    def unbendable_bitmask(self):
+        return unpack_word(self._get_("unbendable_bitmask"))
+
+    @property
+    def hardheadedness(self):
+        return popcount(self.unbendable_bitmask)
+
+    @property
+    def basically_happy(self):
+        return bool(self._get_("basically_happy"))
+
+    @property
+    def move_threshold(self):
+        return float(self._get_("move_threshold"))
+
+    @property
+    def money(self):
+        return float(self._get_("money"))
+
+    @money.setter
+    def money(self, value):
+        self.population.total_money += value - self.money
+        self._set_("money", value)
+
+    @property
+    def seniority(self):
+        return float(self._get_("seniority"))
+
+    @property
+    def earned_ytd(self):
+        return float(self._get_("earned_ytd"))
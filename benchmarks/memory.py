@@ -0,0 +1,103 @@
+##
+#   Memory benchmark, reports how many bytes each simulated resident costs.
+#   "before" is the old layout (a __dict__ per Person and TownPersonStatus),
+#   "after" is the slotted layout and the array backed population. The
+#   World's HappinessCache is on top of the object layouts while a step runs.
+#
+#   Usage: python benchmarks/memory.py [residents]
+##
+
+from dataclasses import dataclass
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from happiness import HappinessCache
+from simulationobjects import Person, PopulationStore, TownPersonStatus
+
+
+class DictPerson:
+    """Person as it was laid out before __slots__."""
+
+    def __init__(self, person: Person):
+        for name in Person.__slots__:
+            setattr(self, name, getattr(person, name))
+
+
+@dataclass
+class DictTownPersonStatus:
+    earned_ytd: int
+    seniority: float
+
+
+def bytes_per_resident(build, residents: int):
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    population = build(residents)
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Keep the population alive until after the measurement
+    del population
+
+    return (after - before) / residents
+
+
+def build_dict_population(residents: int):
+    # Same store and status container the old Town kept, with __dict__ backed members
+    people = [DictPerson(Person(8)) for _ in range(residents)]
+    people_status = {person.id: DictTownPersonStatus(0, random.randint(0, 25) / 100) for person in people}
+
+    return people, people_status
+
+
+def build_slotted_population(residents: int):
+    people = PopulationStore(8)
+
+    for _ in range(residents):
+        people.append(Person(8), TownPersonStatus(0, random.randint(0, 25) / 100))
+
+    return people
+
+
+def happiness_cache_bytes_per_resident(residents: int, platforms: int = 5):
+    """What a HappinessCache holding everyone's score against platforms platforms costs, people not included."""
+    people = [Person(8) for _ in range(residents)]
+    cache = HappinessCache()
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+
+    # At most one score per resident per town platform in a step
+    for platform in range(platforms):
+        for person in people:
+            cache.check_happiness(person, platform)
+
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return (after - before) / residents
+
+
+def build_array_population(residents: int):
+    import numpy as np
+    from arraypopulation import generate_population
+
+    return generate_population(residents, 8, np.random.default_rng(0))
+
+
+if __name__ == "__main__":
+    residents = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    print(f"Bytes per resident ({residents} residents)")
+    print(f"  before (dict Person + status):   {bytes_per_resident(build_dict_population, residents):8.1f}")
+    print(f"  after  (slotted PopulationStore): {bytes_per_resident(build_slotted_population, residents):8.1f}")
+    print(f"  + HappinessCache during a step:  {happiness_cache_bytes_per_resident(residents):8.1f}  (5 towns, cleared after the step)")
+
+    try:
+        print(f"  after  (ArrayPopulation):         {bytes_per_resident(build_array_population, residents):8.1f}")
+    except ImportError:
+        print("  after  (ArrayPopulation):         NumPy not installed")
@@ -0,0 +1,386 @@
+##
+#   Scaling benchmark suite for the simulation core. Sweeps population per
+#   town, town count, platform width and mover rate one at a time around a
+#   base world, times micro benchmarks of the hot methods, and writes it all
+#   to a JSON file. Comparing two result files flags every headline metric
+#   that got worse by more than a threshold, and exits non-zero if any did.
+#
+#   Usage: python benchmarks/suite.py run --output results.json [--quick]
+#          python benchmarks/suite.py compare baseline.json results.json [--threshold 0.1]
+##
+
+import argparse
+from dataclasses import dataclass, field
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from happiness import HappinessCache
+from simulationobjects import Person, Town, World
+
+
+FORMAT_VERSION = 1
+
+# Headline metrics compare checks, and which way is better
+COMPARED_METRICS = {
+    "steps_per_second": "higher",
+    "calls_per_second": "higher",
+    "build_seconds": "lower",
+    "peak_memory_bytes": "lower",
+}
+
+BASE_CASE = {"towns": 5, "population": 1000, "platform_width": 8, "mover_rate": 0.1}
+
+SWEEPS = {
+    "population": [1000, 10000, 100000, 1000000],
+    "towns": [2, 5, 10, 50],
+    "platform_width": [8, 16, 32, 64, 128, 256],
+    "mover_rate": [0, 0.01, 0.1, 0.5],
+}
+
+# Every case is run on both population backends
+BACKENDS = ("objects", "arrays")
+
+
+@dataclass
+class BenchmarkCase:
+    kind: str
+    backend: str
+    parameters: dict = field(default_factory=dict)
+
+    @property
+    def name(self):
+        parameters = "/".join(f"{name}={value}" for name, value in sorted(self.parameters.items()))
+
+        return f"{self.kind}/{self.backend}/{parameters}"
+
+
+def environment():
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "system": platform.system(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "numpy": numpy_version,
+        "commit": commit,
+    }
+
+
+def set_mover_rate(world: World, mover_rate: float, seed: int):
+    """Make about mover_rate of everyone want to leave every step, and nobody else ever."""
+    rng = random.Random(seed)
+
+    for town in world.towns:
+        if town.array_backed:
+            import numpy as np
+            town.people.move_threshold[:] = np.where(
+                np.random.default_rng(rng.getrandbits(64)).random(len(town.people)) < mover_rate, float("inf"), float("-inf")
+            )
+            continue
+
+        for person in town.people:
+            person.move_threshold = float("inf") if rng.random() < mover_rate else float("-inf")
+
+
+def build_world(parameters: dict, backend: str, seed: int, profile: bool = False):
+    world = World(
+        num_towns=parameters["towns"],
+        town_pop_min=parameters["population"],
+        town_pop_max=parameters["population"],
+        platform_width=parameters["platform_width"],
+        array_backed=backend == "arrays",
+        seed=seed,
+        profile=profile
+    )
+    set_mover_rate(world, parameters["mover_rate"], seed)
+
+    return world
+
+
+def run_world_case(case: BenchmarkCase, seed: int, min_seconds: float, min_steps: int, measure_memory: bool):
+    start = time.perf_counter()
+    world = build_world(case.parameters, case.backend, seed, profile=True)
+    build_seconds = time.perf_counter() - start
+
+    phase_totals = {}
+    steps = 0
+    start = time.perf_counter()
+
+    while steps < min_steps or time.perf_counter() - start < min_seconds:
+        step_info = world.step_world()
+        steps += 1
+
+        for name, value in step_info.profile.as_dict().items():
+            phase_totals[name] = phase_totals.get(name, 0) + value
+
+    elapsed = time.perf_counter() - start
+    metrics = {
+        "steps": steps,
+        "steps_per_second": steps / elapsed,
+        "build_seconds": build_seconds,
+        # Seconds are per step in milliseconds, counts are per step
+        "phases": {
+            name: (1000 * value / steps if name not in ("happiness_evaluations", "cost_lookups") else value / steps)
+            for name, value in phase_totals.items()
+        },
+    }
+
+    del world
+
+    if measure_memory:
+        # Its own pass, tracing would slow the timed one down
+        tracemalloc.start()
+        world = build_world(case.parameters, case.backend, seed)
+        world.step_world()
+        metrics["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return metrics
+
+
+def time_calls(function, min_seconds: float):
+    """Calls per second of function, best of three timings of at least min_seconds each."""
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    number = max(number, int(number * min_seconds / 0.2))
+
+    return number / min(timer.repeat(repeat=3, number=number))
+
+
+def run_micro_case(case: BenchmarkCase, seed: int, min_seconds: float):
+    parameters = case.parameters
+    array_backed = case.backend == "arrays"
+    rng = random.Random(seed)
+
+    if case.kind == "check_happiness":
+        person = Person(parameters["platform_width"], rng=rng)
+        platform_value = rng.getrandbits(parameters["platform_width"])
+
+        if parameters["cached"]:
+            cache = HappinessCache()
+            return {"calls_per_second": time_calls(lambda: person.check_happiness(platform_value, cache), min_seconds)}
+
+        return {"calls_per_second": time_calls(lambda: person.check_happiness(platform_value), min_seconds)}
+
+    if case.kind in ("vote_for_platform", "step_town"):
+        town = Town(
+            parameters["population"], parameters["population"], parameters["platform_width"],
+            array_backed=array_backed, rng=rng
+        )
+
+        if case.kind == "vote_for_platform":
+            return {"calls_per_second": time_calls(town.vote_for_platform, min_seconds)}
+
+        # Keep the bank topped up so every call does the full amount of work
+        def step_town():
+            town.town_bank = town.starting_bank
+            town.step_town(parameters["tax_step"])
+
+        return {"calls_per_second": time_calls(step_town, min_seconds)}
+
+    if case.kind == "move_people":
+        world = build_world(parameters, case.backend, seed)
+        timings = []
+
+        # Only the market is timed, get_movers gives it a fresh set of movers each round
+        deadline = time.perf_counter() + min_seconds
+
+        while len(timings) < 3 or time.perf_counter() < deadline:
+            movers = [town.get_movers(world.happiness_cache) for town in world.towns]
+            start = time.perf_counter()
+            world.move_people(movers)
+            timings.append(time.perf_counter() - start)
+
+        return {"calls_per_second": 1 / min(timings), "calls": len(timings)}
+
+    raise ValueError(f"Unknown micro benchmark {case.kind}")
+
+
+def world_cases(sweeps: dict):
+    cases = []
+    seen = set()
+
+    for swept, values in sweeps.items():
+        for value in values:
+            parameters = dict(BASE_CASE, **{swept: value})
+
+            for backend in BACKENDS:
+                case = BenchmarkCase("world", backend, parameters)
+
+                # The base case turns up in every sweep
+                if case.name not in seen:
+                    seen.add(case.name)
+                    cases.append(case)
+
+    return cases
+
+
+def micro_cases(max_population: int):
+    cases = []
+
+    for platform_width in (8, 64, 256, 1024):
+        for cached in (False, True):
+            cases.append(BenchmarkCase("check_happiness", "objects", {"platform_width": platform_width, "cached": cached}))
+
+    for backend in BACKENDS:
+        for population in (1000, 100000):
+            if population > max_population:
+                continue
+
+            cases.append(BenchmarkCase("vote_for_platform", backend, {"population": population, "platform_width": 8}))
+
+            for tax_step in (False, True):
+                cases.append(BenchmarkCase("step_town", backend, {"population": population, "platform_width": 8, "tax_step": tax_step}))
+
+        cases.append(BenchmarkCase("move_people", backend, dict(BASE_CASE)))
+
+    return cases
+
+
+def run_suite(args: argparse.Namespace):
+    sweeps = {swept: [value for value in values if swept != "population" or value <= args.max_population] for swept, values in SWEEPS.items()}
+    cases = world_cases(sweeps) + micro_cases(args.max_population)
+
+    if args.only:
+        cases = [case for case in cases if args.only in case.name]
+
+    results = []
+
+    for case in cases:
+        result = {"name": case.name, "kind": case.kind, "backend": case.backend, "parameters": case.parameters}
+
+        print(f"{case.name} ...", file=sys.stderr, flush=True)
+
+        if case.kind == "world":
+            result["metrics"] = run_world_case(case, args.seed, args.min_seconds, args.min_steps, not args.no_memory)
+        else:
+            result["metrics"] = run_micro_case(case, args.seed, args.min_seconds)
+
+        results.append(result)
+
+    return {
+        "version": FORMAT_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": environment(),
+        "settings": {
+            "seed": args.seed,
+            "min_seconds": args.min_seconds,
+            "min_steps": args.min_steps,
+            "max_population": args.max_population,
+            "memory": not args.no_memory,
+        },
+        "results": results,
+    }
+
+
+def load_results(path: str):
+    with open(path) as results_file:
+        results = json.load(results_file)
+
+    if results.get("version") != FORMAT_VERSION:
+        raise ValueError(f"{path} has benchmark format version {results.get('version')}, expected {FORMAT_VERSION}")
+
+    return results
+
+
+def compare(baseline: dict, current: dict, threshold: float):
+    """Every compared metric of every case in both files, as (name, metric, old, new, change, regressed)."""
+    baseline_results = {result["name"]: result for result in baseline["results"] if "metrics" in result}
+    rows = []
+
+    for result in current["results"]:
+        old = baseline_results.get(result["name"])
+
+        if old is None or "metrics" not in result:
+            continue
+
+        for metric, better in COMPARED_METRICS.items():
+            if metric not in result["metrics"] or metric not in old["metrics"]:
+                continue
+
+            old_value = old["metrics"][metric]
+            new_value = result["metrics"][metric]
+            change = (new_value - old_value) / old_value if old_value else 0
+            regressed = change < -threshold if better == "higher" else change > threshold
+            rows.append((result["name"], metric, old_value, new_value, change, regressed))
+
+    return rows
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the simulation core.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="run the suite and write the results")
+    run.add_argument("--output", default="-", help="JSON results file, - for stdout")
+    run.add_argument("--seed", type=int, default=0, help="seed for every world and town built")
+    run.add_argument("--min-seconds", type=float, default=1.0, help="shortest time to spend timing each case")
+    run.add_argument("--min-steps", type=int, default=3, help="fewest world steps to time each world case over")
+    run.add_argument("--max-population", type=int, default=1000000, help="largest population per town to sweep up to")
+    run.add_argument("--no-memory", action="store_true", help="skip the traced pass measuring peak memory")
+    run.add_argument("--only", default=None, help="only run cases whose name contains this")
+    run.add_argument("--quick", action="store_true", help="short timings and populations up to 10000, for a smoke test")
+
+    comparison = commands.add_parser("compare", help="flag regressions between two result files")
+    comparison.add_argument("baseline", help="results to compare against")
+    comparison.add_argument("current", help="results to check")
+    comparison.add_argument("--threshold", type=float, default=0.1, help="relative change counted as a regression")
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.command == "run":
+        if args.quick:
+            args.min_seconds = min(args.min_seconds, 0.2)
+            args.max_population = min(args.max_population, 10000)
+
+        results = run_suite(args)
+
+        if args.output == "-":
+            json.dump(results, sys.stdout, indent=2)
+        else:
+            with open(args.output, "w") as output:
+                json.dump(results, output, indent=2)
+
+        return 0
+
+    rows = compare(load_results(args.baseline), load_results(args.current), args.threshold)
+
+    for name, metric, old_value, new_value, change, regressed in rows:
+        print(f"{'REGRESSED' if regressed else 'ok':>9}  {change:+7.1%}  {metric:<18} {old_value:14.4g} -> {new_value:<14.4g} {name}")
+
+    regressions = sum(row[-1] for row in rows)
+    print(f"{regressions} of {len(rows)} metrics regressed by more than {args.threshold:.0%}", file=sys.stderr)
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+##
+#   Checkpoint and restore of a whole World. Everyone in a town is written as
+#   a handful of flat arrays (in the order they live in the town, which the
+#   step shuffle depends on) along with every random stream's state, so a
+#   restored world carries on exactly as the original would have.
+#
+#   File layout: MAGIC, an 8 byte header length, a JSON header, then the raw
+#   arrays back to back at the offsets the header lists. Preferences and
+#   unbendable masks are rows of packed 64 bit words, one word per row up to
+#   64 issues. Cohort backed towns are written as their cohort rows instead.
+##
+
+import json
+import random
+import struct
+
+import numpy as np
+
+# Per resident columns, written the same way for both population backends
+from arraypopulation import COLUMNS as PERSON_COLUMNS
+from cohortpopulation import COLUMNS as COHORT_COLUMNS
+from happiness import pack_words, unpack_words, words_for
+from simulationobjects import IDManager, Person, Town, TownPersonStatus, World
+
+
+MAGIC = b"PPCKPT\x00\x00"
+FORMAT_VERSION = 1
+
+
+def _random_state(rng):
+    version, internal_state, gauss_next = rng.getstate()
+
+    return {"version": version, "internal_state": list(internal_state), "gauss_next": gauss_next}
+
+
+def _set_random_state(rng, state: dict):
+    rng.setstate((state["version"], tuple(state["internal_state"]), state["gauss_next"]))
+
+
+def _town_columns(town: Town):
+    if town.cohort_backed:
+        return {name: getattr(town.people, name).copy() for name in COHORT_COLUMNS}
+
+    if town.array_backed:
+        return {name: getattr(town.people, name).copy() for name in PERSON_COLUMNS}
+
+    people = town.people
+    words = words_for(town.platform_width)
+    columns = {
+        "ids": [person.id for person in people.people],
+        "basically_happy": [person.basically_happy for person in people.people],
+        "move_threshold": [person.move_threshold for person in people.people],
+        "money": [person.money for person in people.people],
+        "seniority": [status.seniority for status in people.statuses],
+        "earned_ytd": [status.earned_ytd for status in people.statuses],
+    }
+    columns = {name: np.array(values, dtype=PERSON_COLUMNS[name]) for name, values in columns.items()}
+    columns["preference_base_bits"] = pack_words([person.preference_base_bits for person in people.people], words)
+    columns["unbendable_bitmask"] = pack_words([person.unbendable_bitmask for person in people.people], words)
+
+    return columns
+
+
+def _town_header(town: Town):
+    header = {
+        "id": town.id,
+        "platform_width": town.platform_width,
+        "starting_population": town.starting_population,
+        "starting_wealth_per_person": town.starting_wealth_per_person,
+        "starting_bank": town.starting_bank,
+        "town_bank": town.town_bank,
+        "income_town_tax_rate": town.income_town_tax_rate,
+        "town_utility_rate": town.town_utility_rate,
+        "town_platform": town.town_platform,
+        "array_backed": town.array_backed,
+        "cohort_backed": town.cohort_backed,
+        # Rows are only merged past twice this, restoring it keeps them merged at the same steps
+        "consolidated_size": town.people._consolidated_size if town.cohort_backed else None,
+        "bulk_init": town.bulk_init,
+        # Running aggregates are saved as they are, a recompute could differ in the last bits
+        "total_money": town.people.total_money,
+        "vote_tally": [int(count) for count in town.people.vote_tally],
+        # The global stream is saved once for the world
+        "random_state": None if town.rng is random else _random_state(town.rng),
+        "array_rng_state": town._array_rng.bit_generator.state if hasattr(town, "_array_rng") else None,
+    }
+
+    return header
+
+
+def save_checkpoint(world: World, path: str):
+    arrays = []
+    towns = []
+
+    for town in world.towns:
+        town_header = _town_header(town)
+        town_header["columns"] = {}
+
+        for name, column in _town_columns(town).items():
+            town_header["columns"][name] = {"dtype": column.dtype.str, "length": len(column), "shape": column.shape, "index": len(arrays)}
+            arrays.append(np.ascontiguousarray(column))
+
+        towns.append(town_header)
+
+    header = {
+        "version": FORMAT_VERSION,
+        "world": {
+            "steps_in_year": world.steps_in_year,
+            "years_to_vote": world.years_to_vote,
+            "current_step": world.current_step,
+            "seed": world.seed,
+            "debug_aggregates": world.debug_aggregates,
+            "group_movers": world.group_movers,
+            "bucket_destinations": world.bucket_destinations,
+            "workers": world.workers,
+            "fast_forward": world.fast_forward,
+            "cohort_backed": world.cohort_backed,
+            "steps_skipped": world.steps_skipped,
+            # Keyed by town order, ids don't survive JSON as ints
+            "quiet_costs": None if world.quiet_costs is None else [world.quiet_costs[town.id] for town in world.towns],
+            "random_state": None if world.rng is random else _random_state(world.rng),
+        },
+        # Anything still drawing from the random module needs its state too
+        "global_random_state": _random_state(random),
+        "next_id": IDManager.id,
+        "towns": towns,
+    }
+
+    offset = 0
+    header["array_offsets"] = []
+    for array in arrays:
+        header["array_offsets"].append(offset)
+        offset += array.nbytes
+
+    header_bytes = json.dumps(header).encode("utf-8")
+
+    with open(path, "wb") as checkpoint_file:
+        checkpoint_file.write(MAGIC)
+        checkpoint_file.write(struct.pack("<Q", len(header_bytes)))
+        checkpoint_file.write(header_bytes)
+
+        for array in arrays:
+            checkpoint_file.write(array.tobytes())
+
+
+def _read_checkpoint(path: str):
+    with open(path, "rb") as checkpoint_file:
+        if checkpoint_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a party platform checkpoint")
+
+        (header_length,) = struct.unpack("<Q", checkpoint_file.read(8))
+        header = json.loads(checkpoint_file.read(header_length).decode("utf-8"))
+
+        if header["version"] != FORMAT_VERSION:
+            raise ValueError(f"Checkpoint format version {header['version']} is not supported, expected {FORMAT_VERSION}")
+
+        data = checkpoint_file.read()
+
+    return header, data
+
+
+def _restore_town(town_header: dict, data: bytes, array_offsets: list):
+    # Build an empty town so every attribute exists, then put the saved state into it
+    town = Town(
+        0, 0, town_header["platform_width"], town_header["starting_wealth_per_person"], town_header["town_utility_rate"], town_header["income_town_tax_rate"],
+        array_backed=town_header["array_backed"], bulk_init=town_header["bulk_init"],
+        rng=None if town_header["random_state"] is None else random.Random(), cohort_backed=town_header.get("cohort_backed", False)
+    )
+
+    for name in ("id", "starting_population", "starting_bank", "town_bank", "town_platform"):
+        setattr(town, name, town_header[name])
+
+    if town_header["random_state"] is not None:
+        _set_random_state(town.rng, town_header["random_state"])
+    if town_header["array_rng_state"] is not None:
+        town._array_rng = np.random.default_rng()
+        town._array_rng.bit_generator.state = town_header["array_rng_state"]
+
+    columns = {}
+    for name, column in town_header["columns"].items():
+        shape = column.get("shape", [column["length"]])
+        columns[name] = np.frombuffer(data, dtype=column["dtype"], count=int(np.prod(shape)), offset=array_offsets[column["index"]]).reshape(shape)
+
+    if town.cohort_backed:
+        town.people._consolidated_size = town_header["consolidated_size"]
+        town.people.extend(columns)
+    elif town.array_backed:
+        town.people.extend(columns)
+    else:
+        rows = zip(*(unpack_words(columns[name]) if name in ("preference_base_bits", "unbendable_bitmask") else columns[name].tolist() for name in PERSON_COLUMNS))
+
+        for id, preference_base_bits, unbendable_bitmask, basically_happy, move_threshold, money, seniority, earned_ytd in rows:
+            person = Person.from_values(id, town.platform_width, preference_base_bits, unbendable_bitmask, basically_happy, move_threshold, money)
+            town.people.append(person, TownPersonStatus(earned_ytd, seniority))
+
+    town.people.total_money = town_header["total_money"]
+    town.people.vote_tally[:] = town_header["vote_tally"]
+
+    return town
+
+
+def load_checkpoint(path: str):
+    """Rebuild a World exactly as it was saved, including where every random stream was."""
+    header, data = _read_checkpoint(path)
+    world_header = header["world"]
+
+    world = World(
+        num_towns=0,
+        steps_in_year=world_header["steps_in_year"],
+        years_to_vote=world_header["years_to_vote"],
+        debug_aggregates=world_header["debug_aggregates"],
+        group_movers=world_header["group_movers"],
+        bucket_destinations=world_header["bucket_destinations"],
+        seed=world_header["seed"],
+        workers=world_header["workers"],
+        fast_forward=world_header.get("fast_forward", False),
+        cohort_backed=world_header.get("cohort_backed", False)
+    )
+    world.towns = [_restore_town(town_header, data, header["array_offsets"]) for town_header in header["towns"]]
+    world.current_step = world_header["current_step"]
+    world.steps_skipped = world_header.get("steps_skipped", 0)
+
+    if world_header.get("quiet_costs") is not None:
+        world.quiet_costs = {town.id: cost for town, cost in zip(world.towns, world_header["quiet_costs"])}
+    world._index_platforms_()
+
+    if world_header["random_state"] is not None:
+        _set_random_state(world.rng, world_header["random_state"])
+
+    _set_random_state(random, header["global_random_state"])
+    IDManager.id = max(IDManager.id, header["next_id"])
+
+    return world
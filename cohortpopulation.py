@@ -0,0 +1,177 @@
+##
+#   Cohort backed population storage. What a resident does only depends on
+#   their preferences, unbendable mask, basically_happy, which side of each
+#   possible happiness their move_threshold falls, and their seniority, so a
+#   town is held as rows of identical residents with a head count and their
+#   money and earned_ytd totals instead of one row per person.
+#
+#   Rows only merge once a town holds more residents than there are cohorts,
+#   and there are up to 4**width * 2 * 3 * 26 of those (preferences and
+#   masks, basically_happy, threshold classes, starting seniorities), so the
+#   saving depends on platform width. Rows kept by generate_cohorts:
+#
+#       width   50k residents   1M residents   10M residents
+#         3       2,912           2,912          2,912
+#         4      21,744          36,790         37,440
+#         6      44,337         375,283        587,618
+#         8      49,130         819,059      4,547,587
+#
+#   A row is about as big as a per agent resident, so at width 8 rows hardly
+#   merge below a few million residents a town. Past that the rows stop
+#   growing at around ten million however many residents move in.
+#
+#   Everyone in a row is treated as holding the row's average money, so a
+#   row moves, stays and pays as one. See cohortvalidation.py for how its
+#   statistics compare with the per agent engine.
+##
+
+import numpy as np
+
+from arraypopulation import ColumnPopulation, _column_property, count_vote_bits, generate_columns
+
+
+# Column name -> dtype for everything we store per cohort row
+COLUMNS = {
+    "preference_base_bits": np.uint64,
+    "unbendable_bitmask": np.uint64,
+    "basically_happy": np.bool_,
+    "move_threshold": np.float64,
+    "seniority": np.float64,
+    "counts": np.int64,
+    # Totals over everyone in the row
+    "money": np.float64,
+    "earned_ytd": np.float64,
+}
+
+# Columns that together say which cohort a row is
+KEY_COLUMNS = ("preference_base_bits", "unbendable_bitmask", "basically_happy", "move_threshold", "seniority")
+
+
+def canonical_thresholds(move_threshold, preference_width: int):
+    """Map every move_threshold to one value per class of thresholds that behave identically.
+
+    A threshold is only ever compared with happiness / preference_width, so
+    any two thresholds with the same possible happiness fractions above,
+    equal to and below them make the same choices. Those equal to a fraction
+    are kept, the rest become the midpoint of the fractions either side.
+    """
+    move_threshold = np.asarray(move_threshold, dtype=np.float64)
+    step = 1 / preference_width
+    # Padded so every threshold has a fraction on both sides
+    fractions = np.concatenate(([-step], np.arange(preference_width + 1) / preference_width, [1 + step]))
+    below = np.searchsorted(fractions, move_threshold, side="left")
+    exact = fractions[np.minimum(below, len(fractions) - 1)] == move_threshold
+    below = np.clip(below, 1, len(fractions) - 1)
+
+    return np.where(exact, move_threshold, (fractions[below - 1] + fractions[below]) / 2)
+
+
+def generate_cohorts(count: int, preference_width: int, rng: np.random.Generator, town_id: int = None, chunk_size: int = 1 << 20):
+    """Draw count residents the same way generate_columns does, a chunk at a time, and keep only their cohorts."""
+    population = CohortPopulation(preference_width, town_id)
+
+    for start in range(0, count, chunk_size):
+        columns = generate_columns(min(chunk_size, count - start), preference_width, rng)
+        population.extend_people(columns)
+
+    population.consolidate()
+
+    return population
+
+
+class CohortPopulation(ColumnPopulation):
+    COLUMNS = COLUMNS
+
+    preference_base_bits = _column_property("preference_base_bits")
+    unbendable_bitmask = _column_property("unbendable_bitmask")
+    basically_happy = _column_property("basically_happy")
+    move_threshold = _column_property("move_threshold")
+    seniority = _column_property("seniority")
+    counts = _column_property("counts")
+    money = _column_property("money")
+    earned_ytd = _column_property("earned_ytd")
+
+    def __init__(self, preference_width: int, town_id: int = None, capacity: int = 16):
+        super().__init__(preference_width, town_id, capacity)
+        # Residents over all the rows, vote_tally counts every one of them
+        self.residents = 0
+        # Duplicate cohorts are harmless, rows are merged once there are twice as many as last time
+        self._consolidated_size = 0
+
+    def __len__(self):
+        return self.residents
+
+    def __iter__(self):
+        raise TypeError("Cohort backed populations don't hold individual people")
+
+    @property
+    def average_money(self):
+        return self.money / self.counts
+
+    def extend(self, columns: dict, keep_status: bool = True):
+        """Bulk append cohort rows, newcomers start with no seniority or earnings unless keep_status."""
+        rows = len(columns["counts"])
+        self._reserve_(self.size + rows)
+
+        for name, column in self._columns.items():
+            column[self.size:self.size + rows] = np.reshape(columns[name], self._column_shape_(name, rows))
+
+        if not keep_status:
+            self._columns["seniority"][self.size:self.size + rows] = 0
+            self._columns["earned_ytd"][self.size:self.size + rows] = 0
+
+        self.size += rows
+        self.residents += int(np.sum(columns["counts"]))
+        self.total_money += float(np.sum(columns["money"]))
+        self.vote_tally += count_vote_bits(np.reshape(columns["preference_base_bits"], (rows, self.words)), self.preference_width, weights=columns["counts"])
+
+        if self.size > 2 * max(self._consolidated_size, 1024):
+            self.consolidate()
+
+    def extend_population(self, other: "CohortPopulation"):
+        """Move everyone in other in here, keeping their standing only if other came from this town."""
+        self.extend({name: getattr(other, name) for name in COLUMNS}, keep_status=other.town_id == self.town_id)
+
+    def extend_people(self, columns: dict):
+        """Bulk append individual residents given as ArrayPopulation columns."""
+        count = len(columns["ids"])
+        people = CohortPopulation(self.preference_width, self.town_id, count)
+        people.extend({
+            "preference_base_bits": columns["preference_base_bits"],
+            "unbendable_bitmask": columns["unbendable_bitmask"],
+            "basically_happy": columns["basically_happy"],
+            "move_threshold": canonical_thresholds(columns["move_threshold"], self.preference_width),
+            "seniority": columns["seniority"],
+            "counts": np.ones(count, dtype=np.int64),
+            "money": columns["money"],
+            "earned_ytd": columns["earned_ytd"],
+        })
+        people.consolidate()
+        self.extend_population(people)
+
+    def consolidate(self):
+        """Merge rows of the same cohort, adding up their counts and totals."""
+        if self.size:
+            key = np.ascontiguousarray(np.concatenate(
+                [np.ascontiguousarray(getattr(self, name)).view(np.uint8).reshape(self.size, -1) for name in KEY_COLUMNS], axis=1
+            ))
+            _, first, inverse = np.unique(key.view(np.dtype((np.void, key.shape[1]))).ravel(), return_index=True, return_inverse=True)
+            inverse = inverse.ravel()
+            merged = {name: getattr(self, name)[first] for name in KEY_COLUMNS}
+
+            for name in ("counts", "money", "earned_ytd"):
+                merged[name] = np.bincount(inverse, weights=getattr(self, name), minlength=len(first)).astype(COLUMNS[name])
+
+            for name, column in merged.items():
+                self._columns[name][:len(first)] = column
+
+            self.size = len(first)
+
+        self._consolidated_size = self.size
+
+    def take(self, mask: np.ndarray):
+        taken = super().take(mask)
+        taken.residents = int(taken.counts.sum())
+        self.residents -= taken.residents
+
+        return taken
@@ -0,0 +1,141 @@
+##
+#   Validation of the cohort backed engine against the per agent one. Runs
+#   the same seeds through both, averages each town's population, resident
+#   wealth, bank and moving cost, and the people moving, over a window of
+#   steps per run, then compares the engines seed by seed. A metric fails
+#   when the engines' means differ by more than the tolerance and by more
+#   than a few standard errors of the paired differences, so seed noise
+#   alone doesn't fail it.
+#
+#   Cohort rows only merge once towns outgrow the number of distinct cohorts,
+#   so the defaults use narrow platforms and large towns. With wide platforms
+#   and small towns nearly every row is one person and the engines can't
+#   differ.
+#
+#   Usage: python cohortvalidation.py --seeds 10 --steps 200 --platform-width 4 --pop-max 100000
+##
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import math
+import os
+import sys
+from typing import Dict, List
+
+from simulationobjects import World
+
+
+# The per agent engine the cohorts are checked against
+REFERENCE_BACKEND = {"array_backed": True}
+COHORT_BACKEND = {"cohort_backed": True}
+
+# Town metrics compared town by town, total_wealth counts the bank so it's split from the residents' wealth
+TOWN_METRICS = ("population", "resident_wealth", "town_bank", "moving_cost")
+WORLD_METRICS = ("people_moved", "people_desire_moved")
+
+
+def run_engine(seed: int, steps: int, world_parameters: Dict, window_start: int):
+    """One run's metrics averaged over steps window_start to steps, keyed like "town_bank[2]" per town."""
+    world = World(seed=seed, **world_parameters)
+    subscription = world.metrics.subscribe(("population", "total_wealth", "town_bank", "moving_cost") + WORLD_METRICS)
+
+    for _ in range(steps):
+        world.step_world()
+
+    batch = subscription.drain()
+    window = slice(window_start, steps)
+    per_town = {
+        "population": batch["population"][window],
+        "resident_wealth": batch["total_wealth"][window] - batch["town_bank"][window],
+        "town_bank": batch["town_bank"][window],
+        "moving_cost": batch["moving_cost"][window],
+    }
+    means = {metric: float(batch[metric][window].mean()) for metric in WORLD_METRICS}
+
+    for metric in TOWN_METRICS:
+        for town, mean in enumerate(per_town[metric].mean(axis=0).tolist()):
+            means[f"{metric}[{town}]"] = mean
+
+    return means
+
+
+def _mean_and_variance(values: List[float]):
+    mean = sum(values) / len(values)
+    variance = sum((value - mean) ** 2 for value in values) / (len(values) - 1) if len(values) > 1 else 0
+
+    return mean, variance
+
+
+def compare_samples(reference: List[float], candidate: List[float], tolerance: float, max_standard_errors: float):
+    """Relative difference of the means, the paired t statistic, and whether that counts as a failure.
+
+    reference and candidate are run averages for the same seeds in the same order.
+    """
+    reference_mean = sum(reference) / len(reference)
+    difference, variance = _mean_and_variance([after - before for before, after in zip(reference, candidate)])
+    standard_error = math.sqrt(variance / len(reference))
+    relative = difference / abs(reference_mean) if reference_mean else (0 if not difference else math.inf)
+    t = difference / standard_error if standard_error else (0 if not difference else math.inf)
+
+    return relative, t, abs(relative) > tolerance and abs(t) > max_standard_errors
+
+
+def validate(seeds: range, steps: int, world_parameters: Dict, window_start: int, tolerance: float, max_standard_errors: float, processes: int = None):
+    """Rows of (metric, reference mean, cohort mean, relative difference, t, failed)."""
+    with ProcessPoolExecutor(max_workers=processes or os.cpu_count()) as executor:
+        runs = {
+            engine: [executor.submit(run_engine, seed, steps, dict(world_parameters, **backend), window_start) for seed in seeds]
+            for engine, backend in (("reference", REFERENCE_BACKEND), ("cohort", COHORT_BACKEND))
+        }
+        samples = {engine: [future.result() for future in futures] for engine, futures in runs.items()}
+
+    rows = []
+
+    for metric in samples["reference"][0]:
+        reference = [means[metric] for means in samples["reference"]]
+        candidate = [means[metric] for means in samples["cohort"]]
+        relative, t, failed = compare_samples(reference, candidate, tolerance, max_standard_errors)
+        rows.append((metric, sum(reference) / len(reference), sum(candidate) / len(candidate), relative, t, failed))
+
+    return rows
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Check the cohort backed engine's statistics against the per agent engine.")
+    parser.add_argument("--seeds", type=int, default=10, help="runs per engine")
+    parser.add_argument("--first-seed", type=int, default=0, help="seed of the first run")
+    parser.add_argument("--steps", type=int, default=200, help="world steps per run")
+    parser.add_argument("--window-start", type=int, default=0, help="first step averaged over, to leave out a warm up")
+    parser.add_argument("--num-towns", type=int, default=5)
+    parser.add_argument("--pop-min", type=int, default=50000, help="smallest starting town population")
+    parser.add_argument("--pop-max", type=int, default=100000, help="largest starting town population")
+    parser.add_argument("--platform-width", type=int, default=4, help="narrow enough that cohort rows merge at these populations")
+    parser.add_argument("--tolerance", type=float, default=0.05, help="relative difference in a mean allowed before it can fail")
+    parser.add_argument("--max-standard-errors", type=float, default=3.0, help="differences within this many standard errors never fail")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes, defaults to every core")
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    world_parameters = {
+        "num_towns": args.num_towns,
+        "town_pop_min": args.pop_min,
+        "town_pop_max": args.pop_max,
+        "platform_width": args.platform_width,
+    }
+    seeds = range(args.first_seed, args.first_seed + args.seeds)
+    rows = validate(seeds, args.steps, world_parameters, args.window_start, args.tolerance, args.max_standard_errors, args.processes)
+
+    for metric, reference_mean, cohort_mean, relative, t, failed in rows:
+        print(f"{'FAILED' if failed else 'ok':>6}  {metric:<22} {reference_mean:14.6g} -> {cohort_mean:<14.6g} {relative:+7.2%}  t={t:+.2f}")
+
+    failures = sum(row[-1] for row in rows)
+    print(f"{failures} of {len(rows)} metrics differ between the engines", file=sys.stderr)
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+##
+#   Monte Carlo ensembles and parameter sweeps. Every (parameters, seed) run
+#   is independent, so runs are spread over a process pool and their results
+#   are streamed back as they finish, appended to a JSON lines file so an
+#   interrupted sweep can be resumed, and summarised per step as the mean and
+#   quantiles across seeds.
+#
+#   Usage: python ensemble.py --seeds 100 --steps 400 --income-tax-rate 0.3 0.36 --results sweep.jsonl
+##
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict, dataclass, field
+import itertools
+import json
+import os
+from typing import Dict, Iterable, List
+
+from simulationobjects import World
+
+
+# World parameters a sweep can vary
+SWEEP_PARAMETERS = ("income_tax_rate", "utility_rate", "starting_wealth_per_person", "num_towns", "years_to_vote")
+
+# Per step values every run records
+METRICS = ("max_population", "min_population", "total_wealth", "people_moved", "people_desire_moved")
+
+
+@dataclass
+class RunConfig:
+    seed: int
+    steps: int
+    world_parameters: Dict = field(default_factory=dict)
+
+    @property
+    def parameters_key(self):
+        return json.dumps(self.world_parameters, sort_keys=True)
+
+    @property
+    def key(self):
+        return json.dumps({"seed": self.seed, "steps": self.steps, "world_parameters": self.world_parameters}, sort_keys=True)
+
+
+@dataclass
+class RunResult:
+    config: RunConfig
+    metrics: Dict[str, List[float]]
+
+    def to_json(self):
+        return json.dumps({"config": asdict(self.config), "metrics": self.metrics})
+
+    @classmethod
+    def from_json(cls, line: str):
+        record = json.loads(line)
+
+        return cls(RunConfig(**record["config"]), record["metrics"])
+
+
+def run_single(config: RunConfig):
+    world = World(seed=config.seed, **config.world_parameters)
+    subscription = world.metrics.subscribe(("population", "total_wealth", "people_moved", "people_desire_moved"))
+
+    for _ in range(config.steps):
+        world.step_world()
+
+    batch = subscription.drain()
+    metrics = {
+        "max_population": batch["population"].max(axis=1).tolist(),
+        "min_population": batch["population"].min(axis=1).tolist(),
+        # Summed town by town like a plain sum() so results don't change in the last bits
+        "total_wealth": [sum(wealth) for wealth in batch["total_wealth"].tolist()],
+        "people_moved": batch["people_moved"].tolist(),
+        "people_desire_moved": batch["people_desire_moved"].tolist(),
+    }
+
+    return RunResult(config, metrics)
+
+
+def sweep_configs(grid: Dict[str, Iterable], seeds: Iterable[int], steps: int, fixed_parameters: Dict = None):
+    """Every combination of the grid values, once per seed."""
+    names = list(grid)
+
+    for values in itertools.product(*(grid[name] for name in names)):
+        world_parameters = dict(fixed_parameters or {})
+        world_parameters.update(zip(names, values))
+
+        for seed in seeds:
+            yield RunConfig(seed, steps, world_parameters)
+
+
+def load_results(results_path: str):
+    if not results_path or not os.path.exists(results_path):
+        return []
+
+    with open(results_path) as results_file:
+        return [RunResult.from_json(line) for line in results_file if line.strip()]
+
+
+def run_ensemble(configs: Iterable[RunConfig], results_path: str = None, processes: int = None):
+    """Run configs over a process pool, yielding each RunResult as it finishes.
+
+    Results are appended to results_path as they come in, and configs already
+    in that file are skipped, so re-running the same sweep resumes it.
+    """
+    done = {result.config.key for result in load_results(results_path)}
+    pending = [config for config in configs if config.key not in done]
+
+    if not pending:
+        return
+
+    results_file = open(results_path, "a") if results_path else None
+
+    try:
+        with ProcessPoolExecutor(max_workers=processes or os.cpu_count()) as executor:
+            futures = [executor.submit(run_single, config) for config in pending]
+
+            for future in as_completed(futures):
+                result = future.result()
+
+                if results_file:
+                    results_file.write(result.to_json() + "\n")
+                    results_file.flush()
+
+                yield result
+    finally:
+        if results_file:
+            results_file.close()
+
+
+def _quantile(sorted_values: List[float], q: float):
+    # Linear interpolation between the closest ranks
+    position = (len(sorted_values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def aggregate(results: Iterable[RunResult], quantiles: Iterable[float] = (0.05, 0.5, 0.95)):
+    """Per step mean and quantiles of every metric across seeds, per parameter set."""
+    quantiles = list(quantiles)
+    grouped = {}
+
+    for result in results:
+        grouped.setdefault(result.config.parameters_key, []).append(result)
+
+    summary = {}
+
+    for parameters_key, runs in grouped.items():
+        steps = min(len(run.metrics[METRICS[0]]) for run in runs)
+        statistics = {}
+
+        for metric in METRICS:
+            means, quantile_series = [], {q: [] for q in quantiles}
+
+            for step in range(steps):
+                values = sorted(run.metrics[metric][step] for run in runs)
+                means.append(sum(values) / len(values))
+
+                for q in quantiles:
+                    quantile_series[q].append(_quantile(values, q))
+
+            statistics[metric] = {"mean": means, "quantiles": {str(q): series for q, series in quantile_series.items()}}
+
+        summary[parameters_key] = {"runs": len(runs), "world_parameters": runs[0].config.world_parameters, "statistics": statistics}
+
+    return summary
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Run seeded ensembles of the simulation over a parameter grid.")
+    parser.add_argument("--seeds", type=int, default=100, help="number of seeds per parameter set")
+    parser.add_argument("--first-seed", type=int, default=0, help="seed of the first run in each ensemble")
+    parser.add_argument("--steps", type=int, default=400, help="world steps per run")
+    parser.add_argument("--income-tax-rate", type=float, nargs="+", default=[0.36])
+    parser.add_argument("--utility-rate", type=float, nargs="+", default=[0.1])
+    parser.add_argument("--starting-wealth-per-person", type=int, nargs="+", default=[100])
+    parser.add_argument("--num-towns", type=int, nargs="+", default=[5])
+    parser.add_argument("--years-to-vote", type=int, nargs="+", default=[4])
+    parser.add_argument("--pop-max", type=int, default=1000, help="largest starting town population")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes, defaults to every core")
+    parser.add_argument("--results", default="ensemble_results.jsonl", help="JSON lines file of finished runs, used to resume")
+    parser.add_argument("--summary", default="ensemble_summary.json", help="file for the aggregated statistics")
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    grid = {name: getattr(args, name) for name in SWEEP_PARAMETERS}
+    seeds = range(args.first_seed, args.first_seed + args.seeds)
+    configs = list(sweep_configs(grid, seeds, args.steps, {"town_pop_max": args.pop_max}))
+
+    for finished, result in enumerate(run_ensemble(configs, args.results, args.processes), start=1):
+        print(f"[{finished}] seed {result.config.seed} {result.config.world_parameters}")
+
+    # Summarise everything in the results file that belongs to this sweep
+    wanted = {config.key for config in configs}
+    results = [result for result in load_results(args.results) if result.config.key in wanted]
+
+    with open(args.summary, "w") as summary_file:
+        json.dump(aggregate(results), summary_file)
+
+    print(f"{len(results)} runs summarised in {args.summary}")
+
+
+if __name__ == "__main__":
+    main()
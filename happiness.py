@@ -0,0 +1,163 @@
+##
+#   Happiness engine. A person's happiness against a platform only depends on
+#   how many of their unbendable bits disagree with it, so instead of walking
+#   the bits one at a time we count them with a popcount of
+#   (preference ^ environment) & unbendable_bitmask.
+#
+#   Platforms can be wider than a machine word. Python ints already are, and
+#   NumPy columns hold them as rows of little endian 64 bit words, counted a
+#   word at a time.
+##
+
+from typing import Iterable
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Bits per word of a packed NumPy bitset
+WORD_BITS = 64
+
+
+if hasattr(int, "bit_count"):
+    def popcount(value: int) -> int:
+        return value.bit_count()
+else:
+    def popcount(value: int) -> int:
+        return bin(value).count("1")
+
+
+def words_for(preference_width: int) -> int:
+    """Number of 64 bit words a bitset of preference_width bits is packed into."""
+    return max(1, -(-preference_width // WORD_BITS))
+
+
+def pack_words(values: Iterable[int], words: int):
+    """Pack Python ints into a (len(values), words) array of little endian 64 bit words."""
+    packed = b"".join(int(value).to_bytes(8 * words, "little") for value in values)
+
+    return np.frombuffer(packed, dtype="<u8").reshape(-1, words).astype(np.uint64)
+
+
+def unpack_words(rows) -> list:
+    """Python ints back out of rows of packed words, a 1D array is one word per value."""
+    rows = np.asarray(rows, dtype=np.uint64)
+    rows = rows.reshape(len(rows), -1) if rows.ndim < 2 else rows
+    row_bytes = 8 * rows.shape[1]
+    data = rows.astype("<u8").tobytes()
+
+    return [int.from_bytes(data[start:start + row_bytes], "little") for start in range(0, len(data), row_bytes)]
+
+
+def unpack_word(row) -> int:
+    """A single row of packed words as a Python int."""
+    return int.from_bytes(np.asarray(row, dtype="<u8").tobytes(), "little")
+
+
+def _as_words_(column):
+    column = np.asarray(column, dtype=np.uint64)
+
+    # A flat column is a bitset of one word per person
+    return column.reshape(-1, 1) if column.ndim == 1 else column
+
+
+def check_happiness(preference_bits: int, unbendable_bitmask: int, basically_happy: bool, preference_width: int, environment_value: int) -> int:
+    considered = popcount(unbendable_bitmask)
+    mismatched = popcount((preference_bits ^ environment_value) & unbendable_bitmask)
+
+    # Every considered bit is +1 if it matches and -1 if it doesn't
+    hapinness = (preference_width if basically_happy else 0) + considered - 2 * mismatched
+
+    return min(max(hapinness, 0), preference_width)
+
+
+def popcount_array(values):
+    """Per element popcount of an unsigned 64 bit array."""
+    values = np.asarray(values, dtype=np.uint64)
+
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values).astype(np.int64)
+
+    # Older NumPy, count through a byte lookup table
+    as_bytes = values.reshape(-1, 1).view(np.uint8)
+    return _BYTE_POPCOUNT[as_bytes].sum(axis=1, dtype=np.int64).reshape(values.shape)
+
+
+def check_happiness_batch(preference_bits, unbendable_bitmask, basically_happy, preference_width: int, environment_values):
+    """Score a whole population against one or more platforms in one go.
+
+    Takes per person columns, bitsets as (population, words) arrays of
+    packed words or flat arrays for platforms up to 64 bits, and returns an
+    array of scores shaped (len(environment_values), population), or just
+    (population,) when environment_values is a single platform.
+    """
+    preference_bits = _as_words_(preference_bits)
+    unbendable_bitmask = _as_words_(unbendable_bitmask)
+    single_platform = np.ndim(environment_values) == 0
+    environments = pack_words(np.atleast_1d(np.asarray(environment_values, dtype=object)).tolist(), preference_bits.shape[1])
+
+    base = np.where(basically_happy, preference_width, 0) + popcount_array(unbendable_bitmask).sum(axis=1)
+    mismatched = popcount_array(
+        (preference_bits[np.newaxis, :, :] ^ environments[:, np.newaxis, :]) & unbendable_bitmask[np.newaxis, :, :]
+    ).sum(axis=2)
+    scores = np.clip(base[np.newaxis, :] - 2 * mismatched, 0, preference_width)
+
+    return scores[0] if single_platform else scores
+
+
+def check_population_happiness(people: Iterable, environment_values):
+    """check_happiness_batch for a plain collection of Person objects."""
+    people = list(people)
+    preference_width = people[0].preference_width if people else 0
+    words = words_for(preference_width)
+
+    return check_happiness_batch(
+        pack_words([person.preference_base_bits for person in people], words),
+        pack_words([person.unbendable_bitmask for person in people], words),
+        np.array([person.basically_happy for person in people], dtype=np.bool_),
+        preference_width,
+        environment_values
+    )
+
+
+if np is not None:
+    _BYTE_POPCOUNT = np.array([popcount(byte) for byte in range(256)], dtype=np.uint8)
+
+
+class HappinessCache:
+    """Memo table of happiness scores keyed by platform value then person id.
+
+    Shared by get_movers and the market within a step. World.move_people
+    calls clear() at the end of every step, so it never holds more than one
+    step's worth of scores.
+    """
+
+    def __init__(self):
+        self.tables = {}
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+
+        return self.hits / lookups if lookups else 0
+
+    def check_happiness(self, person, environment_value: int) -> int:
+        table = self.tables.setdefault(environment_value, {})
+        hapinness = table.get(person.id)
+
+        if hapinness is None:
+            self.misses += 1
+            hapinness = check_happiness(person.preference_base_bits, person.unbendable_bitmask, person.basically_happy, person.preference_width, environment_value)
+            table[person.id] = hapinness
+        else:
+            self.hits += 1
+
+        return hapinness
+
+    def clear(self):
+        """Drop every score, the hit and miss counts carry on."""
+        self.tables = {}
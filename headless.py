@@ -0,0 +1,181 @@
+##
+#   Headless batch runner. Builds a World from command line parameters, runs
+#   it as fast as it can and streams the per step metrics to a JSON lines
+#   file. Never imports Kivy so it starts quickly on machines without a UI.
+#
+#   Usage: python headless.py --steps 1000 --seed 42 --output run.jsonl
+#          python headless.py --steps 1000 --resume world.ckpt --checkpoint-out later.ckpt
+##
+
+import argparse
+import json
+import sys
+import time
+
+from simulationobjects import World
+
+
+# Every per step record holds these, plus the step's profile when profiling
+RECORD_METRICS = ("people_moved", "people_desire_moved", "steps_skipped", "population", "total_wealth", "town_bank", "platform", "moving_cost")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Run the party platform simulation without the UI.")
+    parser.add_argument("--steps", type=int, default=1000, help="number of world steps to run")
+    parser.add_argument("--towns", type=int, default=5, help="number of towns")
+    parser.add_argument("--pop-max", type=int, default=1000, help="largest starting town population")
+    parser.add_argument("--pop-min", type=int, default=0, help="smallest starting town population")
+    parser.add_argument("--platform-width", type=int, default=8, help="number of issues on a platform")
+    parser.add_argument("--steps-in-year", type=int, default=10, help="steps between tax steps")
+    parser.add_argument("--years-to-vote", type=int, default=4, help="years between elections")
+    parser.add_argument("--seed", type=int, default=None, help="world seed, every town and the market get a stream derived from it")
+    parser.add_argument("--workers", type=int, default=1, help="threads stepping towns in parallel, only faster with --array-backed or --cohort-backed, results don't depend on it")
+    parser.add_argument("--output", default="-", help="JSON lines file for per step metrics, - for stdout")
+    parser.add_argument("--trajectory", default=None, help="also record a memory mappable trajectory into this directory")
+    parser.add_argument("--resume", default=None, help="carry on from this checkpoint instead of building a new world")
+    parser.add_argument("--checkpoint-out", default=None, help="write a checkpoint of the world here when the run ends")
+    parser.add_argument("--array-backed", action="store_true", help="store towns as NumPy columns")
+    parser.add_argument("--cohort-backed", action="store_true", help="store towns as cohorts of identical people, for very large populations")
+    parser.add_argument("--bulk-init", action="store_true", help="draw starting populations as whole columns")
+    parser.add_argument("--group-movers", action="store_true", help="work out the market per preference class")
+    parser.add_argument("--bucket-destinations", action="store_true", help="pick destinations by platform bucket")
+    parser.add_argument("--fast-forward", action="store_true", help="skip steps where nobody can move in closed form, they get no record")
+    parser.add_argument("--profile", action="store_true", help="time every phase of a step, per step in the output and summed at the end")
+
+    return parser
+
+
+def build_world(args: argparse.Namespace):
+    return World(
+        num_towns=args.towns,
+        steps_in_year=args.steps_in_year,
+        years_to_vote=args.years_to_vote,
+        town_pop_max=args.pop_max,
+        town_pop_min=args.pop_min,
+        platform_width=args.platform_width,
+        array_backed=args.array_backed,
+        cohort_backed=args.cohort_backed,
+        bulk_init=args.bulk_init,
+        group_movers=args.group_movers,
+        bucket_destinations=args.bucket_destinations,
+        seed=args.seed,
+        workers=args.workers,
+        profile=args.profile,
+        fast_forward=args.fast_forward
+    )
+
+
+def write_records(output, batch: dict, profile_totals: dict = None):
+    """Write a JSON line per step of a metrics batch, adding up profiles into profile_totals."""
+    columns = {name: values.tolist() for name, values in batch.items()}
+
+    for index, step in enumerate(columns["step"]):
+        record = {"step": step}
+        record.update((name, columns[name][index]) for name in RECORD_METRICS)
+        profile = columns["profile"][index] if "profile" in columns else None
+
+        if profile is not None:
+            record["profile"] = profile
+
+            if profile_totals is not None:
+                add_profile(profile_totals, profile)
+
+        output.write(json.dumps(record) + "\n")
+
+
+def add_profile(totals: dict, profile: dict):
+    for name, value in profile.items():
+        totals[name] = totals.get(name, 0) + value
+
+
+def format_profile(totals: dict, steps: int):
+    total = totals.get("total", 0) or 1
+    lines = []
+
+    for name, value in totals.items():
+        if name in ("happiness_evaluations", "cost_lookups"):
+            lines.append(f"{name:>22} {value / steps:12.1f} per step")
+        else:
+            lines.append(f"{name:>22} {1000 * value / steps:12.3f} ms/step {100 * value / total:6.1f}%")
+
+    return "\n".join(lines)
+
+
+def run(world: World, steps: int, output, recorder=None, profile_totals: dict = None, batch_steps: int = 1024):
+    """Step the world steps steps on, writing a record per step stepped, and return steps per second."""
+    names = RECORD_METRICS + (("profile",) if world.profile else ())
+    records = world.metrics.subscribe(names, callback=lambda batch: write_records(output, batch, profile_totals), batch_size=batch_steps)
+
+    if recorder is not None:
+        # Shares the metrics both want with the records instead of working them out again
+        recorder.attach(world)
+
+    start = time.perf_counter()
+    last_step = world.current_step + steps
+
+    try:
+        while world.current_step < last_step:
+            # Fast forwarding mustn't carry the world past the last step
+            world.step_world(max_skip=last_step - world.current_step - 1)
+    finally:
+        records.close()
+
+    elapsed = time.perf_counter() - start
+
+    return steps / elapsed if elapsed else float("inf")
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.resume:
+        from checkpoint import load_checkpoint
+        world = load_checkpoint(args.resume)
+    else:
+        world = build_world(args)
+
+    recorder = None
+    # Resumed worlds profile, fast forward and use as many workers as asked for now, whatever they did before
+    world.profile = args.profile
+    world.fast_forward = args.fast_forward
+
+    if world.workers != args.workers:
+        world.set_workers(args.workers)
+
+    profile_totals = {} if args.profile else None
+
+    if args.trajectory:
+        # Only needs NumPy when asked for
+        from trajectory import TrajectoryRecorder
+        recorder = TrajectoryRecorder(args.trajectory, len(world.towns), platform_width=world.towns[0].platform_width if world.towns else 64)
+
+    # A resumed world's count includes whatever it skipped before
+    skipped_before = world.steps_skipped
+
+    try:
+        if args.output == "-":
+            steps_per_second = run(world, args.steps, sys.stdout, recorder, profile_totals)
+        else:
+            with open(args.output, "w") as output:
+                steps_per_second = run(world, args.steps, output, recorder, profile_totals)
+    finally:
+        if recorder is not None:
+            recorder.close()
+
+    if args.checkpoint_out:
+        from checkpoint import save_checkpoint
+        save_checkpoint(world, args.checkpoint_out)
+
+    steps_skipped = world.steps_skipped - skipped_before
+    print(f"{args.steps} steps at {steps_per_second:.2f} steps/sec", file=sys.stderr)
+
+    if world.fast_forward:
+        print(f"{steps_skipped} steps fast forwarded", file=sys.stderr)
+
+    if profile_totals:
+        # Only the steps actually stepped have a profile
+        print(format_profile(profile_totals, args.steps - steps_skipped), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
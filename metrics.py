@@ -0,0 +1,151 @@
+##
+#   Metrics pipeline for World steps. Consumers subscribe to just the metrics
+#   they need, sampled every so many steps. Each step, a metric is only
+#   worked out if some subscription is due to sample it, and then only once
+#   however many subscriptions want it. Samples are buffered per subscription
+#   and handed over as batches of NumPy arrays, either when drained or to a
+#   callback every batch_size samples. A world nobody subscribes to does no
+#   metrics work at all.
+##
+
+from array import array
+from dataclasses import dataclass
+import threading
+from typing import Callable, Iterable
+
+
+@dataclass
+class Metric:
+    # (world, step_info) -> the value, or a list or array of one value per town if per_town
+    compute: Callable
+    per_town: bool = False
+    # array typecode samples are buffered as, None keeps Python objects (platforms of any width, profiles)
+    typecode: str = "d"
+
+
+METRICS = {
+    "people_moved": Metric(lambda world, step_info: step_info.number_people_moved, typecode="q"),
+    "people_desire_moved": Metric(lambda world, step_info: step_info.number_people_desire_moved, typecode="q"),
+    "steps_skipped": Metric(lambda world, step_info: step_info.steps_skipped, typecode="q"),
+    "profile": Metric(lambda world, step_info: None if step_info.profile is None else step_info.profile.as_dict(), typecode=None),
+    "population": Metric(lambda world, step_info: [town.population for town in world.towns], per_town=True, typecode="q"),
+    "total_wealth": Metric(lambda world, step_info: [town.get_total_wealth() for town in world.towns], per_town=True),
+    "average_wealth": Metric(lambda world, step_info: [town.average_wealth if town.population else 0 for town in world.towns], per_town=True),
+    "town_bank": Metric(lambda world, step_info: [town.town_bank for town in world.towns], per_town=True),
+    "platform": Metric(lambda world, step_info: [town.town_platform for town in world.towns], per_town=True, typecode=None),
+    "moving_cost": Metric(lambda world, step_info: step_info.current_market.moving_cost_array(), per_town=True),
+    "people_leaving": Metric(
+        lambda world, step_info: [step_info.current_market.demand_for(town).num_people_leaving for town in world.towns], per_town=True, typecode="q"
+    ),
+    "people_wanting": Metric(
+        lambda world, step_info: [step_info.current_market.demand_for(town).num_people_want for town in world.towns], per_town=True, typecode="q"
+    ),
+}
+
+
+class Subscription:
+    """Samples of some metrics every few steps, buffered until drained or passed to callback."""
+
+    def __init__(self, hub: "MetricsHub", names: Iterable[str], every: int = 1, callback: Callable = None, batch_size: int = 1):
+        self.hub = hub
+        self.names = tuple(names)
+        self.every = every
+        # Called with every batch_size samples from the stepping thread, otherwise samples wait for drain()
+        self.callback = callback
+        self.batch_size = batch_size
+        # The stepping thread fills buffers while another thread may be draining them
+        self._lock = threading.Lock()
+        self._reset_()
+
+    def _reset_(self):
+        self._steps = array("q")
+        self._buffers = {name: [] if METRICS[name].typecode is None else array(METRICS[name].typecode) for name in self.names}
+
+    @property
+    def pending(self):
+        """Samples taken since the last drain."""
+        return len(self._steps)
+
+    def _deliver_(self, step: int, values: dict):
+        with self._lock:
+            self._steps.append(step)
+
+            for name in self.names:
+                if METRICS[name].per_town:
+                    self._buffers[name].extend(values[name])
+                else:
+                    self._buffers[name].append(values[name])
+
+        if self.callback is not None and self.pending >= self.batch_size:
+            self.callback(self.drain())
+
+    def drain(self):
+        """Everything sampled since the last drain as {"step": steps, name: values}, oldest first.
+
+        Per town metrics are (samples, towns) arrays, the rest (samples,).
+        Metrics without a typecode come back as object arrays.
+        """
+        import numpy as np
+
+        with self._lock:
+            steps, buffers = self._steps, self._buffers
+            self._reset_()
+
+        samples = len(steps)
+        batch = {"step": np.array(steps, dtype=np.int64)}
+
+        for name, buffer in buffers.items():
+            if METRICS[name].typecode is None:
+                values = np.empty(len(buffer), dtype=object)
+                values[:] = buffer
+            else:
+                values = np.array(buffer)
+
+            batch[name] = values.reshape(samples, len(self.hub.world.towns)) if METRICS[name].per_town else values
+
+        return batch
+
+    def close(self):
+        """Stop sampling, handing anything still buffered to the callback."""
+        self.hub.unsubscribe(self)
+
+        if self.callback is not None and self.pending:
+            self.callback(self.drain())
+
+
+class MetricsHub:
+    """Hands out subscriptions to a World's per step metrics and fills them as it steps."""
+
+    def __init__(self, world):
+        self.world = world
+        # Replaced rather than changed, so a step going through them is never disturbed
+        self.subscriptions = ()
+
+    def subscribe(self, names: Iterable[str], every: int = 1, callback: Callable = None, batch_size: int = 1):
+        names = tuple(names)
+        unknown = [name for name in names if name not in METRICS]
+
+        if unknown:
+            raise ValueError(f"Unknown metrics {unknown}, expected some of {list(METRICS)}")
+
+        subscription = Subscription(self, names, every, callback, batch_size)
+        self.subscriptions = self.subscriptions + (subscription,)
+
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self.subscriptions = tuple(other for other in self.subscriptions if other is not subscription)
+
+    def observe(self, step: int, step_info):
+        """Sample step for every subscription due, working out each metric wanted once."""
+        values = {}
+
+        for subscription in self.subscriptions:
+            if step % subscription.every:
+                continue
+
+            for name in subscription.names:
+                if name not in values:
+                    values[name] = METRICS[name].compute(self.world, step_info)
+
+            subscription._deliver_(step, values)
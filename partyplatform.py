@@ -10,17 +10,26 @@ from kivy.uix.gridlayout import GridLayout
 from kivy.app import App
 from kivy.uix.label import Label
 import random
+import sys
 from simulationobjects import World
+from simworker import SimulationWorker
+from timeseries import TimeSeries
+from trajectory import TrajectoryReader, TrajectoryReplay
+
+
+def plot_width(graph: Graph):
+    # About one point per pixel is all a plot can show
+    return max(int(graph.width), 3)
 
 
 class PopulationGraph(RelativeLayout):
     pop_graph = ObjectProperty(None)
 
-    def __init__(self, town_colors: List[List[int]]):
+    def __init__(self, town_colors: List[List[int]], window: int = None):
         super().__init__()
         num_towns = len(town_colors)
 
-        self.population_lists = [[] for _ in range(num_towns)]
+        self.population_lists = [TimeSeries(window) for _ in range(num_towns)]
         self.plots = [LinePlot(color=town_color, line_width=2) for town_color in town_colors]
 
         for plot in self.plots:
@@ -29,21 +38,17 @@ class PopulationGraph(RelativeLayout):
         
 
     def update_graph(self):
-        max_y = 0
-        min_y = -1
+        max_y = max(series.max for series in self.population_lists)
+        min_y = min(series.min for series in self.population_lists)
+
         for i, plot in enumerate(self.plots):
-            start_index = 0 # if len(self.population_lists[i]) < 100 else -100
             # Assemble and set the points
-            plot.points = [(i, pop) for i, pop in enumerate(self.population_lists[i][start_index:])]
-            max_y = max(max_y, max(self.population_lists[i]))
-            if min_y < 0:
-                min_y = min(self.population_lists[i])
-            else:
-                min_y = min(min_y, min(self.population_lists[i]))
+            plot.points = self.population_lists[i].points(plot_width(self.pop_graph))
         
-        self.pop_graph.xmax = len(self.population_lists[0][start_index:]) + 1
-        self.pop_graph.x_ticks_major = self.pop_graph.xmax // 10
-        self.pop_graph.x_ticks_minor = self.pop_graph.xmax // 100
+        self.pop_graph.xmin = self.population_lists[0].first_x
+        self.pop_graph.xmax = self.population_lists[0].last_x + 1
+        self.pop_graph.x_ticks_major = len(self.population_lists[0]) // 10
+        self.pop_graph.x_ticks_minor = len(self.population_lists[0]) // 100
         self.pop_graph.ymax = max_y + 10
         self.pop_graph.ymin = min_y - 10
 
@@ -52,7 +57,7 @@ class PeopleMovedGraph(BoxLayout):
     mov_graph = ObjectProperty(None)
     want_mov_graph = ObjectProperty(None)
 
-    def __init__(self):
+    def __init__(self, window: int = None):
         super().__init__()
         self.orientation = "vertical"
         randint = random.randint
@@ -60,57 +65,56 @@ class PeopleMovedGraph(BoxLayout):
         self.moved_plot = LinePlot(color=[randint(0,100) / 100, randint(0,100) / 100, randint(0,100) / 100, 1], line_width=2)
         self.want_to_move_plot = LinePlot(color=[randint(0,100) / 100, randint(0,100) / 100, randint(0,100) / 100, 1], line_width=2)
 
-        self.want_to_move_list = []
-        self.moved_list = []
+        self.want_to_move_list = TimeSeries(window)
+        self.moved_list = TimeSeries(window)
 
         self.mov_graph.add_plot(self.moved_plot)
         self.want_mov_graph.add_plot(self.want_to_move_plot)
         
     def update_graph(self):
-        start_index = 0 # if len(self.moved_list) < 20 else -20
         # Assemble and set the points
-        self.moved_plot.points = [(i, num_moved) for i, num_moved in enumerate(self.moved_list[start_index:])]
-        self.want_to_move_plot.points = [(i, num_want_moved) for i, num_want_moved in enumerate(self.want_to_move_list[start_index:])]
-
-        self.want_mov_graph.xmax = len(self.want_to_move_list[start_index:]) + 1
-        self.want_mov_graph.x_ticks_major = len(self.want_to_move_list[start_index:]) // 10
-        self.want_mov_graph.x_ticks_minor = len(self.want_to_move_list[start_index:]) // 100
-        self.want_mov_graph.ymax = max(self.want_to_move_list[start_index:]) + 10
-        self.want_mov_graph.ymin = min(self.want_to_move_list[start_index:]) - 10
-
-        self.mov_graph.xmax = len(self.moved_list[start_index:]) + 1
-        self.mov_graph.x_ticks_major = len(self.moved_list[start_index:]) // 10
-        self.mov_graph.x_ticks_minor = len(self.moved_list[start_index:]) // 100
-        self.mov_graph.ymax = max(self.moved_list[start_index:]) + 10
-        self.mov_graph.ymin = min(self.moved_list[start_index:])- 10
+        self.moved_plot.points = self.moved_list.points(plot_width(self.mov_graph))
+        self.want_to_move_plot.points = self.want_to_move_list.points(plot_width(self.want_mov_graph))
+
+        self.want_mov_graph.xmin = self.want_to_move_list.first_x
+        self.want_mov_graph.xmax = self.want_to_move_list.last_x + 1
+        self.want_mov_graph.x_ticks_major = len(self.want_to_move_list) // 10
+        self.want_mov_graph.x_ticks_minor = len(self.want_to_move_list) // 100
+        self.want_mov_graph.ymax = self.want_to_move_list.max + 10
+        self.want_mov_graph.ymin = self.want_to_move_list.min - 10
+
+        self.mov_graph.xmin = self.moved_list.first_x
+        self.mov_graph.xmax = self.moved_list.last_x + 1
+        self.mov_graph.x_ticks_major = len(self.moved_list) // 10
+        self.mov_graph.x_ticks_minor = len(self.moved_list) // 100
+        self.mov_graph.ymax = self.moved_list.max + 10
+        self.mov_graph.ymin = self.moved_list.min - 10
 
 class TownWealthGraph(RelativeLayout):
     pop_graph = ObjectProperty(None)
 
-    def __init__(self, town_colors: List[List[int]]):
+    def __init__(self, town_colors: List[List[int]], window: int = None):
         super().__init__()
         num_towns = len(town_colors)
 
-        self.wealth_lists = [[] for _ in range(num_towns)]
+        self.wealth_lists = [TimeSeries(window) for _ in range(num_towns)]
         self.plots = [LinePlot(color=town_color, line_width=2) for town_color in town_colors]
 
         for plot in self.plots:
             self.wealth_graph.add_plot(plot)
 
     def update_graph(self):
-        y_max = 0
+        y_max = max(series.max for series in self.wealth_lists)
+
         for i, plot in enumerate(self.plots):
-            start_index = 0 # if len(self.population_lists[i]) < 100 else -100
             # Assemble and set the points
-            plot.points = [(i, pop) for i, pop in enumerate(self.wealth_lists[i][start_index:])]
-            y_max_temp = max(self.wealth_lists[i][start_index:])
-            if y_max_temp > y_max:
-                y_max = y_max_temp
+            plot.points = self.wealth_lists[i].points(plot_width(self.wealth_graph))
 
         # Extend the plots max x
-        self.wealth_graph.xmax = len(self.wealth_lists[0][start_index:]) + 1
-        self.wealth_graph.x_ticks_major = self.wealth_graph.xmax // 10
-        self.wealth_graph.x_ticks_minor = self.wealth_graph.xmax // 100
+        self.wealth_graph.xmin = self.wealth_lists[0].first_x
+        self.wealth_graph.xmax = self.wealth_lists[0].last_x + 1
+        self.wealth_graph.x_ticks_major = len(self.wealth_lists[0]) // 10
+        self.wealth_graph.x_ticks_minor = len(self.wealth_lists[0]) // 100
 
         self.wealth_graph.ymax = y_max
         self.wealth_graph.y_ticks_major = y_max // 10
@@ -119,30 +123,28 @@ class TownWealthGraph(RelativeLayout):
 class AverageWealthGraph(RelativeLayout):
     avg_wealth_graph = ObjectProperty(None)
 
-    def __init__(self, town_colors: List[List[int]]):
+    def __init__(self, town_colors: List[List[int]], window: int = None):
         super().__init__()
         num_towns = len(town_colors)
 
-        self.wealth_lists = [[] for _ in range(num_towns)]
+        self.wealth_lists = [TimeSeries(window) for _ in range(num_towns)]
         self.plots = [LinePlot(color=town_color, line_width=2) for town_color in town_colors]
 
         for plot in self.plots:
             self.avg_wealth_graph.add_plot(plot)
 
     def update_graph(self):
-        y_max = 0
+        y_max = max(series.max for series in self.wealth_lists)
+
         for i, plot in enumerate(self.plots):
-            start_index = 0 # if len(self.population_lists[i]) < 100 else -100
             # Assemble and set the points
-            plot.points = [(i, pop) for i, pop in enumerate(self.wealth_lists[i][start_index:])]
-            y_max_temp = max(self.wealth_lists[i][start_index:])
-            if y_max_temp > y_max:
-                y_max = y_max_temp
+            plot.points = self.wealth_lists[i].points(plot_width(self.avg_wealth_graph))
 
         # Extend the plots max x
-        self.avg_wealth_graph.xmax = len(self.wealth_lists[0][start_index:]) + 1
-        self.avg_wealth_graph.x_ticks_major = self.avg_wealth_graph.xmax // 10
-        self.avg_wealth_graph.x_ticks_minor = self.avg_wealth_graph.xmax // 100
+        self.avg_wealth_graph.xmin = self.wealth_lists[0].first_x
+        self.avg_wealth_graph.xmax = self.wealth_lists[0].last_x + 1
+        self.avg_wealth_graph.x_ticks_major = len(self.wealth_lists[0]) // 10
+        self.avg_wealth_graph.x_ticks_minor = len(self.wealth_lists[0]) // 100
 
         self.avg_wealth_graph.ymax = y_max
         self.avg_wealth_graph.y_ticks_major = y_max // 10
@@ -151,40 +153,37 @@ class AverageWealthGraph(RelativeLayout):
 class MarketDemandGraph(RelativeLayout):
     market_dmd_graph = ObjectProperty(None)
 
-    def __init__(self, town_colors: List[List[int]]):
+    def __init__(self, town_colors: List[List[int]], window: int = None):
         super().__init__()
         num_towns = len(town_colors)
 
-        self.demand_lists = [[] for _ in range(num_towns)]
+        self.demand_lists = [TimeSeries(window) for _ in range(num_towns)]
         self.plots = [LinePlot(color=town_color, line_width=2) for town_color in town_colors]
 
         for plot in self.plots:
             self.market_dmd_graph.add_plot(plot)
 
     def update_graph(self):
-        y_max = 0
+        y_max = max(series.max for series in self.demand_lists)
         
         for i, plot in enumerate(self.plots):
-            start_index = 0 # if len(self.population_lists[i]) < 100 else -100
             # Assemble and set the points
-            plot.points = [(i, pop) for i, pop in enumerate(self.demand_lists[i][start_index:])]
-            y_max_temp = max(self.demand_lists[i][start_index:])
-            if y_max_temp > y_max:
-                y_max = y_max_temp
+            plot.points = self.demand_lists[i].points(plot_width(self.market_dmd_graph))
 
         # Extend the plots max x
-        self.market_dmd_graph.xmax = len(self.demand_lists[0][start_index:]) + 1
-        self.market_dmd_graph.x_ticks_major = self.market_dmd_graph.xmax // 10
-        self.market_dmd_graph.x_ticks_minor = self.market_dmd_graph.xmax // 100
+        self.market_dmd_graph.xmin = self.demand_lists[0].first_x
+        self.market_dmd_graph.xmax = self.demand_lists[0].last_x + 1
+        self.market_dmd_graph.x_ticks_major = len(self.demand_lists[0]) // 10
+        self.market_dmd_graph.x_ticks_minor = len(self.demand_lists[0]) // 100
 
         self.market_dmd_graph.ymax = y_max
         self.market_dmd_graph.y_ticks_major = y_max // 10
         self.market_dmd_graph.y_ticks_minor = y_max // 100
 
 class ControlPanel(BoxLayout):
-    def __init__(self, start_callback, kwargs):
+    def __init__(self, sim_worker: SimulationWorker, kwargs):
         super().__init__(**kwargs)
-        self.start_callback = start_callback
+        self.sim_worker = sim_worker
         self.sim_started = False
 
     def start_stop_sim(self):
@@ -192,61 +191,110 @@ class ControlPanel(BoxLayout):
 
         if self.sim_started:
             self.ids.go_button.text = "Stop"
-            Clock.schedule_interval(self.start_callback, 1/10)
+            self.sim_worker.start()
         else:
             self.ids.go_button.text = "Go"
+            self.sim_worker.pause()
+
+    def set_rate(self, steps_per_second: float):
+        # All the way left means as fast as the machine can go
+        self.sim_worker.target_steps_per_second = steps_per_second if steps_per_second > 0 else None
+        self.ids.rate_label.text = f"Target: {int(steps_per_second)} steps/s" if steps_per_second > 0 else "Target: unlimited"
+
+    def show_rates(self, steps_per_second: float, frames_per_second: float):
+        self.ids.stats_label.text = f"Sim: {steps_per_second:.1f} steps/s   UI: {frames_per_second:.1f} fps"
+
+    def show_profile(self, profile: dict):
+        total = profile["total"] or 1
+        phases = ("step_town", "vote_for_platform", "get_movers", "demand", "move")
+
+        self.ids.profile_label.text = (
+            "   ".join(f"{phase}: {100 * profile[phase] / total:.0f}%" for phase in phases)
+            + f"\n{1000 * profile['total']:.2f} ms/step   {profile['happiness_evaluations']} happiness checks   {profile['cost_lookups']} cost lookups"
+        )
             
         
 
 class PartyPlatformApp(App):
     go_button = Button()
 
-    def __init__(self):
+    def __init__(self, replay_path: str = None, profile: bool = False):
         super().__init__()
-        self.world = World()
-        self.update_graphs_dt = 0
 
-    def step_sim(self, dt):
-        step_info = self.world.step_world()
+        if replay_path is None:
+            self.world = World(profile=profile)
+            self.num_towns = len(self.world.towns)
+            # The world is only touched by the worker from here on, the UI just drains its metrics
+            self.sim_worker = SimulationWorker(self.world)
+        else:
+            # Play back a recorded run instead, it hands out batches just like the worker
+            reader = TrajectoryReader(replay_path)
+            self.world = None
+            self.num_towns = reader.num_towns
+            self.sim_worker = TrajectoryReplay(reader)
+
+        # Steps of history the graphs keep, None keeps the whole run
+        self.graph_window = None
+        self.update_graphs_dt = 0
+        self.graphs_stale = False
+        # Most recent step's StepProfile.as_dict(), only set when the world is profiling
+        self.last_profile = None
+
+    def drain_sim(self, dt):
+        # Everything since the last drain in one batch of arrays
+        batch = self.sim_worker.drain()
+        steps = len(batch["step"])
         self.update_graphs_dt += dt
 
-        for town_index in range(len(self.world.towns)):
-            self.population_graph.population_lists[town_index].append(len(self.world.towns[town_index].people))
-            self.wealth_graph.wealth_lists[town_index].append(self.world.towns[town_index].get_total_wealth())
+        if steps:
+            for town_index in range(self.num_towns):
+                self.population_graph.population_lists[town_index].extend(batch["population"][:, town_index])
+                self.wealth_graph.wealth_lists[town_index].extend(batch["total_wealth"][:, town_index])
+                self.town_moving_cost_graph.demand_lists[town_index].extend(batch["moving_cost"][:, town_index])
 
-        self.movers_graph.moved_list.append(step_info.number_people_moved)
-        self.movers_graph.want_to_move_list.append(step_info.number_people_desire_moved)
+            self.movers_graph.moved_list.extend(batch["people_moved"])
+            self.movers_graph.want_to_move_list.extend(batch["people_desire_moved"])
 
-        for i, mc in enumerate(step_info.current_market.moving_costs):
-            self.town_moving_cost_graph.demand_lists[i].append(mc)
-        
+            if "profile" in batch:
+                self.last_profile = batch["profile"][-1] or self.last_profile
+
+        self.graphs_stale = self.graphs_stale or bool(steps)
+
+        if self.update_graphs_dt > 0.5:
+            self.control_panel.show_rates(self.sim_worker.steps_per_second, Clock.get_fps())
+
+            if self.last_profile is not None:
+                self.control_panel.show_profile(self.last_profile)
+
+            if self.graphs_stale:
+                self.population_graph.update_graph()
+                self.movers_graph.update_graph()
+                self.town_moving_cost_graph.update_graph()
+                self.wealth_graph.update_graph()
+                self.graphs_stale = False
 
-        if self.control_panel.sim_started and self.update_graphs_dt > 0.5:
-            self.population_graph.update_graph()
-            self.movers_graph.update_graph()
-            self.town_moving_cost_graph.update_graph()
-            self.wealth_graph.update_graph()
             self.update_graphs_dt = 0
-        else:
-            return self.control_panel.sim_started
+
+    def on_stop(self):
+        self.sim_worker.stop()
     
     @property
     def town_colors(self):
         if not hasattr(self, "_town_colors"):
             randint = random.randint
-            self._town_colors = [[randint(0,100) / 100, randint(0,100) / 100, randint(0,100) / 100, 1] for _ in range(len(self.world.towns))]
+            self._town_colors = [[randint(0,100) / 100, randint(0,100) / 100, randint(0,100) / 100, 1] for _ in range(self.num_towns)]
         
         return self._town_colors
     
     def build(self):
-        root_grid = GridLayout(rows=2 + len(self.world.towns))
+        root_grid = GridLayout(rows=2 + self.num_towns)
         graph_grid = GridLayout(cols=2)
 
-        self.population_graph = PopulationGraph(self.town_colors)
-        self.wealth_graph = TownWealthGraph(self.town_colors)
-        self.town_moving_cost_graph = MarketDemandGraph(self.town_colors)
-        self.movers_graph = PeopleMovedGraph()
-        self.control_panel = ControlPanel(self.step_sim, {"size_hint":(1, 0.3)})
+        self.population_graph = PopulationGraph(self.town_colors, self.graph_window)
+        self.wealth_graph = TownWealthGraph(self.town_colors, self.graph_window)
+        self.town_moving_cost_graph = MarketDemandGraph(self.town_colors, self.graph_window)
+        self.movers_graph = PeopleMovedGraph(self.graph_window)
+        self.control_panel = ControlPanel(self.sim_worker, {"size_hint":(1, 0.3)})
 
         graph_grid.add_widget(self.population_graph)
         graph_grid.add_widget(self.movers_graph)
@@ -256,7 +304,12 @@ class PartyPlatformApp(App):
 
         root_grid.add_widget(self.control_panel)
 
+        # Only ever scheduled once, pressing Go just starts or pauses the worker
+        Clock.schedule_interval(self.drain_sim, 1/30)
+
         return root_grid
 
 if __name__ == "__main__":
-    PartyPlatformApp().run()
\ No newline at end of file
+    # Kivy leaves everything after -- alone, e.g. py ./partyplatform.py -- --replay run_trajectory
+    replay_path = sys.argv[sys.argv.index("--replay") + 1] if "--replay" in sys.argv else None
+    PartyPlatformApp(replay_path, profile="--profile" in sys.argv).run()
\ No newline at end of file
@@ -5,9 +5,17 @@
 #   Author: Travis Adsitt
 ##
 
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
+import math
 import random
-from typing import List
+import time
+from typing import Callable, List
+
+from happiness import HappinessCache, check_happiness, popcount
+from metrics import MetricsHub
 
 
 class IDManager:
@@ -22,75 +30,80 @@ class IDManager:
         cls.id += 1
         
         return cls.id
+
+    @classmethod
+    def getNewIDs(cls, count: int):
+        first_id = cls.id + 1
+        cls.id += count
+
+        return range(first_id, cls.id + 1)
         
 
 class Person:
-    def __init__(self, preference_width: int, move_threshold: float = None):
+    # No per person __dict__, a town can hold a lot of these
+    __slots__ = ("id", "preference_width", "preference_base_bits", "basically_happy", "move_threshold", "money", "hardheadedness", "unbendable_bitmask")
+
+    def __init__(self, preference_width: int, move_threshold: float = None, rng: random.Random = None):
+        # Draw from the global random module unless given a stream of our own
+        rng = random if rng is None else rng
+
         self.id = IDManager.getNewID()
         self.preference_width = preference_width
-        # UINT8 bitfield for preferences
-        self.preference_base_bits = random.getrandbits(self.preference_width) 
+        # Bitfield of preference_width preferences, a Python int so any width works
+        self.preference_base_bits = rng.getrandbits(self.preference_width) 
         # Are we basically happy or sad?
-        self.basically_happy = bool(random.getrandbits(1))
+        self.basically_happy = bool(rng.getrandbits(1))
         # Set a random happiness threshold in a range if None
         if move_threshold == None:
-            self.move_threshold = random.randint(40, 60) / 100
+            self.move_threshold = rng.randint(40, 60) / 100
         else:
             self.move_threshold = move_threshold
         # Set persons money
         self.money = 0
 
         # Setup our unbendables
-        self._set_unbendable_preferences_()
+        self._set_unbendable_preferences_(rng)
 
-    def _set_unbendable_preferences_(self):
+    @classmethod
+    def from_values(cls, id: int, preference_width: int, preference_base_bits: int, unbendable_bitmask: int, basically_happy: bool, move_threshold: float, money: float = 0):
+        """Build a Person from already drawn values instead of drawing new ones."""
+        person = cls.__new__(cls)
+        person.id = id
+        person.preference_width = preference_width
+        person.preference_base_bits = preference_base_bits
+        person.basically_happy = basically_happy
+        person.move_threshold = move_threshold
+        person.money = money
+        person.hardheadedness = popcount(unbendable_bitmask)
+        person.unbendable_bitmask = unbendable_bitmask
+
+        return person
+
+    def _set_unbendable_preferences_(self, rng: random.Random):
         # How many bits will be considered in the happiness calculation
-        self.hardheadedness = random.randint(0, self.preference_width - 1) 
+        self.hardheadedness = rng.randint(0, self.preference_width - 1) 
         # Bitmask to store our unbendable preferences
         self.unbendable_bitmask = 0
 
-        bits_set = 0
-        while bits_set < self.hardheadedness:
-            # Set a random bit
-            random_bit = 1 << random.randint(0, self.preference_width - 1)
-
-            # If it isn't already set add this bit to our unbendables
-            if not bool(self.unbendable_bitmask & random_bit):
-                self.unbendable_bitmask |= random_bit
-                bits_set += 1
+        # Draw hardheadedness distinct bits outright, no retrying bits already set
+        for bit in rng.sample(range(self.preference_width), self.hardheadedness):
+            self.unbendable_bitmask |= 1 << bit
     
     def vote(self):
         return self.preference_base_bits
     
-    def check_happiness(self, environment_value: int):
-        # Set the base level of happiness
-        hapinness = self.preference_width if self.basically_happy else 0
-
-        # Step through all the bits in our preference width
-        for bit in range(0, self.preference_width):
-            if self.unbendable_bitmask & (1 << bit):
-                preference_bit = (self.preference_base_bits >> bit) & 1
-                environment_bit = (environment_value >> bit) & 1
-
-                if preference_bit != environment_bit:
-                    hapinness -= 1
-                
-                if preference_bit == environment_bit:
-                    hapinness += 1
-        
-        if hapinness > self.preference_width:
-            hapinness = self.preference_width
-        elif hapinness < 0:
-            hapinness = 0
-        
-        return hapinness
+    def check_happiness(self, environment_value: int, happiness_cache: HappinessCache = None):
+        if happiness_cache is not None:
+            return happiness_cache.check_happiness(self, environment_value)
+
+        return check_happiness(self.preference_base_bits, self.unbendable_bitmask, self.basically_happy, self.preference_width, environment_value)
     
-    def is_happy(self, environment_value: int):
-        return bool((self.check_happiness(environment_value) / 8) > self.move_threshold)
+    def is_happy(self, environment_value: int, happiness_cache: HappinessCache = None):
+        return bool((self.check_happiness(environment_value, happiness_cache) / self.preference_width) > self.move_threshold)
 
-    def wants_to_move(self, from_env: int, to_env: int):
-        happinness_from = self.check_happiness(from_env) / self.preference_width
-        happinness_to = self.check_happiness(to_env) / self.preference_width
+    def wants_to_move(self, from_env: int, to_env: int, happiness_cache: HappinessCache = None):
+        happinness_from = self.check_happiness(from_env, happiness_cache) / self.preference_width
+        happinness_to = self.check_happiness(to_env, happiness_cache) / self.preference_width
 
         return bool(happinness_from < self.move_threshold) and bool(happinness_to > happinness_from)
 
@@ -99,13 +112,125 @@ class Person:
 
 @dataclass
 class TownPersonStatus:
+    __slots__ = ("earned_ytd", "seniority")
     earned_ytd: int
     seniority: float
 
+class PopulationStore:
+    """Residents of a town with their status records kept alongside them.
+
+    People and statuses live in parallel lists with an id -> slot index, so
+    lookups, appends and removals (swapping the last person into the gap) are
+    all O(1). Statuses of people taken out by partition() are held until the
+    next partition so that anyone who ends up staying gets their standing back.
+
+    The store also keeps a running total of its residents' money and a count
+    of votes for each platform bit. Changes to a resident's money should go
+    through adjust_money() to keep the total right.
+    """
+
+    def __init__(self, preference_width: int):
+        self.people: List[Person] = []
+        self.statuses: List[TownPersonStatus] = []
+        self.slots = {}
+        self.departed = {}
+        self.total_money = 0
+        self.vote_tally = [0 for _ in range(preference_width)]
+
+    def __len__(self):
+        return len(self.people)
+
+    def __iter__(self):
+        return iter(self.people)
+
+    def __contains__(self, person: Person):
+        return person.id in self.slots
+
+    def items(self):
+        return zip(self.people, self.statuses)
+
+    def get(self, id: int):
+        slot = self.slots.get(id)
+
+        return None if slot is None else self.people[slot]
+
+    def status_of(self, id: int):
+        slot = self.slots.get(id)
+
+        return None if slot is None else self.statuses[slot]
+
+    def append(self, person: Person, status: TownPersonStatus = None):
+        if status is None:
+            # Returning from a failed move keeps the old status, newcomers start fresh
+            status = self.departed.pop(person.id, None) or TownPersonStatus(0, 0)
+
+        self.slots[person.id] = len(self.people)
+        self.people.append(person)
+        self.statuses.append(status)
+        self.total_money += person.money
+        self._tally_vote_(person, 1)
+
+    def _tally_vote_(self, person: Person, direction: int):
+        vote = person.vote()
+
+        # Only visit the bits that are set, peeling off the lowest each time
+        while vote:
+            lowest_bit = vote & -vote
+            self.vote_tally[lowest_bit.bit_length() - 1] += direction
+            vote ^= lowest_bit
+
+    def recount_votes(self):
+        """Full recount of vote_tally from scratch, for checking the running tally."""
+        # Only needed for verification, so NumPy stays optional for the object backed town
+        from arraypopulation import count_vote_bits
+
+        return count_vote_bits([person.vote() for person in self.people], len(self.vote_tally))
+
+    def adjust_money(self, person: Person, amount: float):
+        person.money += amount
+        self.total_money += amount
+
+    def remove(self, person: Person):
+        slot = self.slots.pop(person.id)
+        status = self.statuses[slot]
+        last_person = self.people.pop()
+        last_status = self.statuses.pop()
+        self.total_money -= person.money
+        self._tally_vote_(person, -1)
+
+        if slot < len(self.people):
+            self.people[slot] = last_person
+            self.statuses[slot] = last_status
+            self.slots[last_person.id] = slot
+
+        return status
+
+    def partition(self, should_leave: Callable[[Person], bool]):
+        """Split off everyone should_leave picks in a single pass, returning them."""
+        stayers, stayer_statuses, movers = [], [], []
+        self.departed = {}
+
+        for person, status in self.items():
+            if should_leave(person):
+                movers.append(person)
+                self.departed[person.id] = status
+                self.total_money -= person.money
+                self._tally_vote_(person, -1)
+            else:
+                stayers.append(person)
+                stayer_statuses.append(status)
+
+        self.people = stayers
+        self.statuses = stayer_statuses
+        self.slots = {person.id: slot for slot, person in enumerate(stayers)}
+
+        return movers
+
 class Town:
-    def __init__(self, town_pop_max: int, town_pop_min: int = 0, platform_width: int = 8, starting_wealth_per_person: int = 100, utility_rate: int = 0.1, income_tax_rate: int = 0.36):
-        
-        self.starting_population = random.randint(town_pop_min, town_pop_max)
+    def __init__(self, town_pop_max: int, town_pop_min: int = 0, platform_width: int = 8, starting_wealth_per_person: int = 100, utility_rate: int = 0.1, income_tax_rate: int = 0.36, array_backed: bool = False, bulk_init: bool = False, rng: random.Random = None, cohort_backed: bool = False):
+        # Every draw the town makes comes from here, the global random module unless given a stream
+        self.rng = random if rng is None else rng
+        self.starting_population = self.rng.randint(town_pop_min, town_pop_max)
         self.id = IDManager.getNewID()
         self.platform_width = platform_width
         self.starting_wealth_per_person = starting_wealth_per_person
@@ -113,8 +238,15 @@ class Town:
         self.town_bank = self.starting_bank
         self.income_town_tax_rate = income_tax_rate
         self.town_utility_rate = utility_rate
-        self.people_status = {}
-        self.people = []
+        self.people = PopulationStore(platform_width)
+        # Store residents as NumPy columns (see arraypopulation.py) instead of Person objects
+        self.array_backed = array_backed
+        # Store residents as rows of identical people with a head count (see cohortpopulation.py)
+        self.cohort_backed = cohort_backed
+        # Draw the starting population as whole columns, always done for array and cohort backed towns
+        self.bulk_init = bulk_init or array_backed or cohort_backed
+        # Nobody to vote in an empty town, so it starts with nothing on the platform
+        self.town_platform = 0
         
 
         self._init_population_(self.starting_population)
@@ -129,18 +261,58 @@ class Town:
         return len(self.people)
 
     def _init_population_(self, initial_population: int):
+        if self.bulk_init:
+            # Imported here so the object backed simulation doesn't need NumPy
+            import numpy as np
+            from arraypopulation import generate_columns, generate_population
+            from happiness import unpack_words
+
+            # Seeded from random so seeding random still reproduces a run
+            rng = np.random.default_rng(self.rng.getrandbits(64))
+
+            if self.array_backed:
+                self.people = generate_population(initial_population, self.platform_width, rng, self.id)
+                self._array_rng = rng
+                return
+
+            if self.cohort_backed:
+                from cohortpopulation import generate_cohorts
+                self.people = generate_cohorts(initial_population, self.platform_width, rng, self.id)
+                return
+
+            columns = generate_columns(initial_population, self.platform_width, rng)
+            rows = zip(
+                columns["ids"].tolist(), unpack_words(columns["preference_base_bits"]), unpack_words(columns["unbendable_bitmask"]),
+                columns["basically_happy"].tolist(), columns["move_threshold"].tolist(), columns["seniority"].tolist()
+            )
+
+            for id, preference_base_bits, unbendable_bitmask, basically_happy, move_threshold, seniority in rows:
+                new_person = Person.from_values(id, self.platform_width, preference_base_bits, unbendable_bitmask, basically_happy, move_threshold)
+                self.people.append(new_person, TownPersonStatus(0, seniority))
+
+            return
+
         for _ in range(initial_population):
-            new_person = Person(self.platform_width)
+            new_person = Person(self.platform_width, rng=self.rng)
             # Keep track of how long people have lived here
-            self.people_status[new_person.id] = TownPersonStatus(0, random.randint(0, 25) / 100)
-            self.people.append(new_person)
+            self.people.append(new_person, TownPersonStatus(0, self.rng.randint(0, 25) / 100))
+
+    @property
+    def people_status(self):
+        if self.cohort_backed:
+            raise TypeError("Cohort backed towns don't keep a status per person")
+
+        if self.array_backed:
+            # A snapshot, the live values are in the seniority and earned_ytd columns
+            return {person.id: TownPersonStatus(person.earned_ytd, person.seniority) for person in self.people}
+
+        return {person.id: status for person, status in self.people.items()}
     
     def get_person_with_id(self, id: int):
-        for person in self.people:
-            if person.id == id:
-                return person
-        
-        return None
+        if self.cohort_backed:
+            raise TypeError("Cohort backed towns don't keep track of who is who")
+
+        return self.people.get(id)
 
     def calculate_base_rate_taxes(self, person_status: TownPersonStatus):
         taxes = self.income_town_tax_rate * person_status.earned_ytd
@@ -149,57 +321,191 @@ class Town:
         return taxes + utilities
 
     def step_town(self, tax_step: bool = False):
-        for person in self.people:
-            if person.id not in self.people_status:
-                self.people_status[person.id] = TownPersonStatus(0, 0)
+        if self.array_backed:
+            return self._step_town_arrays_(tax_step)
 
-            if self.people_status[person.id].seniority < 1:
-                self.people_status[person.id].seniority += 0.01
+        if self.cohort_backed:
+            return self._step_town_cohorts_(tax_step)
 
-        random_order_keys = list(self.people_status.keys())
-        random.shuffle(random_order_keys)
+        for status in self.people.statuses:
+            if status.seniority < 1:
+                status.seniority += 0.01
 
-        for person in random_order_keys:
-            person_obj = self.get_person_with_id(person)
-            
-            if person_obj is None:
-                continue
+        random_order = list(self.people.items())
+        self.rng.shuffle(random_order)
 
-            step_loss = min(self.town_bank, self.people_status[person].seniority)
-            tax_calculation = self.calculate_base_rate_taxes(self.people_status[person]) * (person_obj.money / self.get_total_wealth())
+        for person_obj, status in random_order:
+            step_loss = min(self.town_bank, status.seniority)
+            tax_calculation = self.calculate_base_rate_taxes(status) * (person_obj.money / self.get_total_wealth())
 
-            self.people_status[person].earned_ytd += step_loss if not tax_step else 0
-            person_obj.money += step_loss if not tax_step else -tax_calculation
+            status.earned_ytd += step_loss if not tax_step else 0
+            self.people.adjust_money(person_obj, step_loss if not tax_step else -tax_calculation)
             self.town_bank -= step_loss if not tax_step else -tax_calculation
 
             if tax_step:
-                self.people_status[person].earned_ytd = 0
-            
+                status.earned_ytd = 0
+
+    def _step_town_arrays_(self, tax_step: bool):
+        import numpy as np
+
+        people = self.people
+        seniority = people.seniority
+        seniority[seniority < 1] += 0.01
+
+        if tax_step:
+            # Everyone is taxed against the wealth at the start of the step rather
+            # than one at a time, so the result doesn't depend on the shuffle order
+            total_wealth = self.get_total_wealth()
+
+            if total_wealth and len(people):
+                taxes = (self.income_town_tax_rate * people.earned_ytd + self.utility_per_person * seniority) * (people.money / total_wealth)
+                people.money -= taxes
+                people.total_money -= float(taxes.sum())
+                self.town_bank += float(taxes.sum())
+
+            people.earned_ytd = 0
+            return
 
+        # Pay out seniority in a random order until the bank runs dry
+        if self.town_bank >= float(seniority.sum()):
+            step_loss = seniority.copy()
+        else:
+            order = self._array_rng.permutation(len(people))
+            paid_before = np.cumsum(seniority[order]) - seniority[order]
+            step_loss = np.empty_like(seniority)
+            step_loss[order] = np.minimum(seniority[order], np.maximum(self.town_bank - paid_before, 0))
+
+        people.earned_ytd += step_loss
+        people.money += step_loss
+        people.total_money += float(step_loss.sum())
+        self.town_bank -= float(step_loss.sum())
+
+    def _step_town_cohorts_(self, tax_step: bool):
+        people = self.people
+        seniority = people.seniority
+        seniority[seniority < 1] += 0.01
+
+        if tax_step:
+            # Like _step_town_arrays_, with everyone in a row holding the row's average money and earnings
+            total_wealth = self.get_total_wealth()
+
+            if total_wealth and len(people):
+                taxes = (self.income_town_tax_rate * people.earned_ytd / people.counts + self.utility_per_person * seniority) * (people.money / total_wealth)
+                people.adjust_money(-taxes)
+                self.town_bank += float(taxes.sum())
+
+            people.earned_ytd = 0
+            return
+
+        owed = seniority * people.counts
+        total_owed = float(owed.sum())
+
+        # Nobody is paid one at a time here, so a bank that can't pay everyone shares out what it has
+        if self.town_bank >= total_owed:
+            step_loss = owed
+        else:
+            step_loss = owed * (self.town_bank / total_owed)
+
+        people.earned_ytd += step_loss
+        people.adjust_money(step_loss)
+        self.town_bank -= float(step_loss.sum())
+
+    def quiet_paths(self, steps: int):
+        """Seniority and running pay over the next steps non tax steps, as prefix tables.
+
+        Returns (classes, seniority, payouts). seniority[k][c] and payouts[k][c]
+        are where anyone starting with the c-th distinct seniority stands after
+        k steps, and classes says which column each resident follows. Raises are
+        replayed 0.01 at a time like step_town so they top out at the same step,
+        float rounding and all, but only once per distinct seniority.
+        """
+        if self.array_backed:
+            import numpy as np
+            values, classes = np.unique(self.people.seniority, return_inverse=True)
+            seniority = np.empty((steps + 1, len(values)))
+            payouts = np.zeros((steps + 1, len(values)))
+            seniority[0] = values
+
+            for step in range(1, steps + 1):
+                seniority[step] = seniority[step - 1]
+                seniority[step][seniority[step] < 1] += 0.01
+                payouts[step] = payouts[step - 1] + seniority[step]
+
+            return classes.ravel(), seniority, payouts
+
+        columns = {}
+        classes = [columns.setdefault(status.seniority, len(columns)) for status in self.people.statuses]
+        seniority = [list(columns)]
+        payouts = [[0] * len(columns)]
+
+        for step in range(steps):
+            seniority.append([value + 0.01 if value < 1 else value for value in seniority[step]])
+            payouts.append([paid + value for paid, value in zip(payouts[step], seniority[step + 1])])
+
+        return classes, seniority, payouts
+
+    def quiet_payouts(self, steps: int, paths=None):
+        """What each resident is paid over the next steps non tax steps, as long as the bank covers everyone in full."""
+        classes, _, payouts = paths or self.quiet_paths(steps)
+
+        if self.array_backed:
+            return payouts[steps][classes]
+
+        return [payouts[steps][column] for column in classes]
+
+    def advance_quiet_steps(self, steps: int, paths=None):
+        """Apply steps non tax steps of seniority raises and pay at once.
+
+        Only the same as stepping one at a time while the bank can pay
+        everyone in full, which is when the payout order doesn't matter.
+        """
+        classes, seniority, payouts = paths or self.quiet_paths(steps)
+
+        if self.array_backed:
+            people = self.people
+            paid = payouts[steps][classes]
+            people.seniority = seniority[steps][classes]
+            people.earned_ytd += paid
+            people.money += paid
+            people.total_money += float(paid.sum())
+            self.town_bank -= float(paid.sum())
+            return
+
+        for (person, status), column in zip(self.people.items(), classes):
+            paid = payouts[steps][column]
+            status.seniority = seniority[steps][column]
+            status.earned_ytd += paid
+            self.people.adjust_money(person, paid)
+            self.town_bank -= paid
 
     def get_total_wealth(self, include_bank: bool = True):
-        return round(sum([person.money for person in self.people]), 2) + (self.town_bank if include_bank else 0)
+        return round(self.people.total_money, 2) + (self.town_bank if include_bank else 0)
     
     @property
     def average_wealth(self):
         return round(self.get_total_wealth(False) / len(self.people), 2)
 
+    def verify_aggregates(self, tolerance: float = 1e-6):
+        """Check the running money total against a full re-sum of the residents."""
+        if self.array_backed or self.cohort_backed:
+            recomputed = float(self.people.money.sum())
+        else:
+            recomputed = sum(person.money for person in self.people)
+
+        if abs(recomputed - self.people.total_money) > tolerance * max(1, abs(recomputed)):
+            raise ValueError(f"Town {self.id} running money total {self.people.total_money} does not match recomputed {recomputed}")
+
+        recounted = list(self.people.recount_votes())
+
+        if recounted != list(self.people.vote_tally):
+            raise ValueError(f"Town {self.id} running vote tally {list(self.people.vote_tally)} does not match recount {recounted}")
+
     def vote_for_platform(self):
         if not self.people:
             return
-        
-        votes = [0 for _ in range(self.platform_width)]
 
-        for person in self.people:
-            vote = person.vote()
-
-            for bit in range(self.platform_width):
-                bit_vote = (vote >> bit) & 1
-
-                if bit_vote > 0:
-                    votes[bit] += 1
-                else:
-                    votes[bit] -= 1
+        # Every resident votes +1 for the bits they have set and -1 for the rest
+        votes = [2 * bit_count - len(self.people) for bit_count in self.people.vote_tally]
         
         platform = 0
 
@@ -209,23 +515,38 @@ class Town:
         
         self.town_platform = platform
 
-    def get_movers(self):
-        movers = []
+    def get_movers(self, happiness_cache: HappinessCache = None):
+        if self.array_backed or self.cohort_backed:
+            return self.people.take(~self.people.is_happy(self.town_platform))
 
-        for person in self.people:
-            if not person.is_happy(self.town_platform):
-                movers.append(person)
-
-        for mover in movers:
-            self.people.remove(mover)
-        
-        return movers
+        return self.people.partition(lambda person: not person.is_happy(self.town_platform, happiness_cache))
 
 @dataclass
 class MovingGroup:
     from_town: Town
     people: List[Person]
 
+@dataclass
+class PreferenceClass:
+    """Movers sharing (preference_base_bits, unbendable_bitmask, basically_happy).
+
+    Everyone in a class is exactly as happy as everyone else with any
+    platform, so the towns they'd rather live in only need working out once.
+    """
+    happinness_from: float
+    better_towns: List[Town]
+    num_people_wanting: int = 0
+
+@dataclass
+class CandidateTowns:
+    """Towns in a set of platform buckets, cheapest to move into first."""
+    towns: List[Town]
+    costs: List[float]
+
+    def num_affordable(self, money: float):
+        # Movers need strictly more money than the cost
+        return bisect_left(self.costs, money)
+
 @dataclass
 class TownDemand:
     town: Town
@@ -234,73 +555,426 @@ class TownDemand:
 
     def get_move_cost_adjustment(self):
         total_movement = self.num_people_want + self.num_people_leaving
+
+        # Nobody coming or going, so no pressure on the price either way
+        if total_movement == 0:
+            return 1
+
         movement_delta = self.num_people_want - self.num_people_leaving
         return 1 + (movement_delta / total_movement)
 
 @dataclass
 class MovingMarket:
+    """Demand for every town, indexed by town id.
+
+    Once demand has been tallied settle_costs() works out every town's cost
+    a single time, after which cost lookups are O(1).
+    """
     base_moving_cost: int
     town_demand: List[TownDemand] = field(default_factory=list)
+    demand_index: dict = field(default_factory=dict)
+    cost_index: dict = field(default_factory=dict)
+    # Calls to get_town_moving_cost, for profiling
+    cost_lookups: int = 0
+
+    def __post_init__(self):
+        for td in self.town_demand:
+            self.demand_index[td.town.id] = td
+
+    def add_town(self, town: Town):
+        td = TownDemand(town)
+        self.town_demand.append(td)
+        self.demand_index[town.id] = td
+
+        return td
+
+    def demand_for(self, town: Town):
+        return self.demand_index[town.id]
+
+    def _calculate_moving_cost_(self, td: TownDemand):
+        return max(self.base_moving_cost * td.get_move_cost_adjustment(), self.base_moving_cost)
+
+    def settle_costs(self):
+        self.cost_index = {td.town.id: self._calculate_moving_cost_(td) for td in self.town_demand}
 
     @property
     def moving_costs(self):
-        town_moving_costs = []
+        return [self.get_town_moving_cost(td.town) for td in self.town_demand]
 
-        for td in self.town_demand:
-            town_moving_costs.append(self.get_town_moving_cost(td.town))
-        
-        return town_moving_costs
+    def moving_cost_array(self):
+        """Moving costs in town order as a flat array of doubles, what the metrics pipeline hands out."""
+        # Settled costs are already in town order, no need to look each one up
+        if len(self.cost_index) == len(self.town_demand):
+            return array("d", self.cost_index.values())
+
+        return array("d", self.moving_costs)
 
     def get_town_moving_cost(self, town: Town):
-        for td in self.town_demand:
-            if td.town == town:
-                return max(self.base_moving_cost * td.get_move_cost_adjustment(), self.base_moving_cost)
+        self.cost_lookups += 1
+        cost = self.cost_index.get(town.id)
+
+        # Demand may still be changing if costs haven't been settled yet
+        if cost is None:
+            return self._calculate_moving_cost_(self.demand_index[town.id])
+
+        return cost
+
+@dataclass
+class TownPhaseProfile:
+    """Seconds one town spent in each part of its own phase of a step."""
+    step_town: float = 0
+    vote_for_platform: float = 0
+    get_movers: float = 0
+    happiness_evaluations: int = 0
+
+@dataclass
+class StepProfile:
+    """Where the time in one World.step_world went, filled in when the world is profiling."""
+    towns: List[TownPhaseProfile] = field(default_factory=list)
+    # Wall time of the whole per town phase, less than the sum over towns when threaded
+    town_phase: float = 0
+    demand: float = 0
+    move: float = 0
+    total: float = 0
+    happiness_evaluations: int = 0
+    cost_lookups: int = 0
+    _lap_start: float = field(default_factory=time.perf_counter, repr=False)
+
+    def lap(self, phase: str):
+        """Add the time since the last lap to phase."""
+        now = time.perf_counter()
+        setattr(self, phase, getattr(self, phase) + now - self._lap_start)
+        self._lap_start = now
+
+    @property
+    def step_town(self):
+        return sum(town.step_town for town in self.towns)
+
+    @property
+    def vote_for_platform(self):
+        return sum(town.vote_for_platform for town in self.towns)
+
+    @property
+    def get_movers(self):
+        return sum(town.get_movers for town in self.towns)
+
+    def as_dict(self):
+        return {
+            "total": self.total,
+            "town_phase": self.town_phase,
+            "step_town": self.step_town,
+            "vote_for_platform": self.vote_for_platform,
+            "get_movers": self.get_movers,
+            "demand": self.demand,
+            "move": self.move,
+            "happiness_evaluations": self.happiness_evaluations,
+            "cost_lookups": self.cost_lookups,
+        }
 
 @dataclass
 class WorldStepInfo:
     number_people_moved: int
     number_people_desire_moved: int
     current_market: MovingMarket
+    profile: StepProfile = None
+    # Quiet steps fast forwarded through before this one
+    steps_skipped: int = 0
 
 class World:
-    def __init__(self, num_towns: int = 5, steps_in_year: int = 10, years_to_vote: int = 4):
-        self.towns = [Town(1000) for _ in range(num_towns)]
+    def __init__(self, num_towns: int = 5, steps_in_year: int = 10, years_to_vote: int = 4, town_pop_max: int = 1000, town_pop_min: int = 0, platform_width: int = 8, starting_wealth_per_person: int = 100, utility_rate: int = 0.1, income_tax_rate: int = 0.36, array_backed: bool = False, bulk_init: bool = False, debug_aggregates: bool = False, group_movers: bool = False, bucket_destinations: bool = False, seed: int = None, workers: int = 1, profile: bool = False, fast_forward: bool = False, cohort_backed: bool = False):
+        # Stepping towns concurrently needs every town on its own stream
+        if seed is None and workers > 1:
+            seed = random.getrandbits(64)
+
+        # With a seed, each town and the market get their own stream derived from it,
+        # so a run only depends on the seed and not on how the towns get stepped
+        self.seed = seed
+        self.rng = random if seed is None else random.Random(f"{seed}/market")
+        self.towns = [
+            Town(
+                town_pop_max, town_pop_min, platform_width, starting_wealth_per_person, utility_rate, income_tax_rate, array_backed=array_backed, bulk_init=bulk_init,
+                rng=None if seed is None else random.Random(f"{seed}/town/{town_number}"), cohort_backed=cohort_backed
+            )
+            for town_number in range(num_towns)
+        ]
         self.steps_in_year = steps_in_year
         self.years_to_vote = years_to_vote
         self.current_step = 0
-    
-    def step_world(self) -> WorldStepInfo:
+        # Check every town's running totals against a full recompute after each step
+        self.debug_aggregates = debug_aggregates
+        # Happiness scores shared by get_movers, demand counting and the move loop, emptied after every step
+        self.happiness_cache = HappinessCache()
+        # Work out demand and destinations once per PreferenceClass instead of per mover
+        self.group_movers = group_movers
+        # Pick destinations from platform buckets instead of scanning every town per mover
+        self.bucket_destinations = bucket_destinations
+        # Towns grouped by their current town_platform
+        self.platform_index = {}
+        self._index_platforms_()
+        # Threads for the per town phase of a step, the market is the barrier between steps.
+        # Object backed towns step in pure Python under the GIL so they don't overlap,
+        # only array and cohort backed towns, whose NumPy work releases it, run faster
+        self.executor = None
+        self.set_workers(workers)
+        # Time every phase of a step and attach a StepProfile to its WorldStepInfo
+        self.profile = profile
+        # Jump over steps where nobody can move and only pay and seniority change
+        self.fast_forward = fast_forward
+        # Moving cost per town id from the last step if nobody moved in it, else None
+        self.quiet_costs = None
+        self.steps_skipped = 0
+        # (what they depend on, cheapest wanted moves per town), see _quiet_cheapest_moves_
+        self._quiet_moves = None
+        # Towns hold cohorts instead of people, which has its own market
+        self.cohort_backed = cohort_backed
+        # Per step metrics for whoever subscribes, see metrics.py
+        self.metrics = MetricsHub(self)
+
+    def set_workers(self, workers: int):
+        """Step towns on this many threads from now on, replacing any pool already running."""
+        if self.executor is not None:
+            self.executor.shutdown()
+
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(workers) if workers > 1 else None
+
+    def _index_platforms_(self):
+        self.platform_index = {}
+
         for town in self.towns:
-            # Boolean check if it is a taxes taxes are being taken
-            town.step_town(bool((self.current_step % self.steps_in_year) == 0))
+            self.platform_index.setdefault(town.town_platform, []).append(town)
+    
+    def _step_town_phase_(self, town: Town, tax_step: bool, voting_step: bool, happiness_cache: HappinessCache):
+        """Everything a town does on its own in a step, returning who wants to leave."""
+        town.step_town(tax_step)
+
+        if voting_step:
+            town.vote_for_platform()
+
+        return town.get_movers(happiness_cache)
+
+    def _profiled_step_town_phase_(self, town: Town, tax_step: bool, voting_step: bool, happiness_cache: HappinessCache):
+        """_step_town_phase_ with each part timed, returning who wants to leave and the timings."""
+        town_profile = TownPhaseProfile()
+        start = time.perf_counter()
+        town.step_town(tax_step)
+        after_step = time.perf_counter()
+
+        if voting_step:
+            town.vote_for_platform()
+
+        after_vote = time.perf_counter()
+        # get_movers scores everyone in town once, a cohort town once per row
+        town_profile.happiness_evaluations = town.people.size if town.cohort_backed else len(town.people)
+        movers = town.get_movers(happiness_cache)
+
+        town_profile.step_town = after_step - start
+        town_profile.vote_for_platform = after_vote - after_step
+        town_profile.get_movers = time.perf_counter() - after_vote
+
+        return movers, town_profile
+
+    def _cheapest_wanted_moves_(self, town: Town):
+        """Cheapest move each resident of town would like to make, inf for anyone who wants to stay."""
+        others = [other for other in self.towns if other is not town]
+
+        if town.array_backed:
+            import numpy as np
+            people = town.people
+            happinness_from = people.check_happiness(town.town_platform)
+
+            if not others or not len(people):
+                return np.full(len(people), math.inf)
+
+            happinness_to = people.check_happiness([other.town_platform for other in others])
+            wants = ((happinness_from / people.preference_width) < people.move_threshold)[np.newaxis, :] & (happinness_to > happinness_from[np.newaxis, :])
+            costs = np.array([self.quiet_costs[other.id] for other in others])[:, np.newaxis]
+
+            return np.where(wants, costs, math.inf).min(axis=0, initial=math.inf)
+
+        cheapest = []
+
+        for person in town.people:
+            # Anyone happy at home doesn't want to go anywhere
+            if person.is_happy(town.town_platform, self.happiness_cache):
+                cheapest.append(math.inf)
+                continue
+
+            cheapest.append(min(
+                (self.quiet_costs[other.id] for other in others if person.wants_to_move(town.town_platform, other.town_platform, self.happiness_cache)),
+                default=math.inf
+            ))
+
+        return cheapest
 
+    def _quiet_cheapest_moves_(self):
+        """_cheapest_wanted_moves_ for every town, only worked out again once something they depend on changes.
+
+        While nobody moves the same people want the same towns at the same
+        costs, and the market puts everyone back in the order it found them.
+        Only a move or a new platform can change that.
+        """
+        key = (tuple(self.quiet_costs.items()), tuple(town.town_platform for town in self.towns), tuple(town.population for town in self.towns))
+
+        if self._quiet_moves is None or self._quiet_moves[0] != key:
+            self._quiet_moves = (key, [self._cheapest_wanted_moves_(town) for town in self.towns])
+
+        return self._quiet_moves[1]
+
+    def _stays_quiet_(self, town: Town, steps: int, paths, cheapest_moves):
+        """Would town pay everyone in full and still have nobody able to afford a move after steps steps?"""
+        payouts = town.quiet_payouts(steps, paths)
+
+        if town.array_backed:
+            return float(payouts.sum()) <= town.town_bank and not (town.people.money + payouts > cheapest_moves).any()
+
+        return sum(payouts) <= town.town_bank and not any(
+            person.money + payout > cheapest for person, payout, cheapest in zip(town.people, payouts, cheapest_moves)
+        )
+
+    def skip_quiet_steps(self, max_steps: int = None):
+        """Fast forward over upcoming steps that can only change money and seniority.
+
+        After a step where nobody moved, the same people keep wanting the same
+        towns at the same costs until an election, and a tax step only takes
+        money away. So every step up to the next tax step is pay and seniority
+        raises alone, until someone can afford their cheapest move or a bank
+        can't pay in full. Both only get closer the longer nobody moves, so
+        the longest quiet stretch is found by binary search over prefix
+        tables of everyone's pay, and applied in one go. Returns how many
+        steps were skipped.
+        """
+        # Cohorts pay out pro rata when a bank runs short, which the closed form doesn't cover
+        if self.quiet_costs is None or self.cohort_backed:
+            return 0
+
+        # Steps before the next tax step, elections only come on tax steps
+        steps = (-self.current_step) % self.steps_in_year
+
+        if max_steps is not None:
+            steps = min(steps, max_steps)
+        if steps <= 0:
+            return 0
+
+        cheapest_moves = self._quiet_cheapest_moves_()
+        paths = [town.quiet_paths(steps) for town in self.towns]
+        quiet, noisy = 0, steps + 1
+
+        while noisy - quiet > 1:
+            middle = (quiet + noisy) // 2
+
+            if all(self._stays_quiet_(town, middle, town_paths, cheapest) for town, town_paths, cheapest in zip(self.towns, paths, cheapest_moves)):
+                quiet = middle
+            else:
+                noisy = middle
+
+        steps = quiet
+
+        for town, town_paths in zip(self.towns, paths):
+            town.advance_quiet_steps(steps, town_paths)
+
+            if self.debug_aggregates:
+                town.verify_aggregates()
+
+        self.current_step += steps
+        self.steps_skipped += steps
+
+        return steps
+
+    def step_world(self, max_skip: int = None) -> WorldStepInfo:
+        """Step the world once, first skipping any quiet steps if fast forwarding, but at most max_skip."""
+        steps_skipped = self.skip_quiet_steps(max_skip) if self.fast_forward else 0
+
+        # Boolean check if it is a taxes taxes are being taken
+        tax_step = bool((self.current_step % self.steps_in_year) == 0)
         # Voting year?
-        if (self.current_step % (self.steps_in_year * self.years_to_vote)) == 0:
+        voting_step = (self.current_step % (self.steps_in_year * self.years_to_vote)) == 0
+        profile = StepProfile() if self.profile else None
+        step_town_phase = self._step_town_phase_ if profile is None else self._profiled_step_town_phase_
+
+        if self.executor is None:
+            movers = [step_town_phase(town, tax_step, voting_step, self.happiness_cache) for town in self.towns]
+        else:
+            # Towns only touch their own state and stream, the shared cache is left out
+            # so threads never write to it
+            movers = list(self.executor.map(lambda town: step_town_phase(town, tax_step, voting_step, None), self.towns))
+
+        if profile is not None:
+            movers, profile.towns = [town_movers for town_movers, _ in movers], [town_profile for _, town_profile in movers]
+            profile.happiness_evaluations = sum(town_profile.happiness_evaluations for town_profile in profile.towns)
+            profile.lap("town_phase")
+
+        if voting_step:
+            self._index_platforms_()
+
+        move_info = self.move_people(movers, profile)
+
+        if profile is not None:
+            profile.lap("move")
+            profile.cost_lookups = move_info.current_market.cost_lookups
+            profile.total = sum((profile.town_phase, profile.demand, profile.move))
+            move_info.profile = profile
+
+        if self.debug_aggregates:
             for town in self.towns:
-                town.vote_for_platform()
+                town.verify_aggregates()
+
+        if self.fast_forward:
+            self.quiet_costs = None if move_info.number_people_moved else dict(move_info.current_market.cost_index)
+
+        move_info.steps_skipped = steps_skipped
 
-        move_info = self.move_people()
+        # Metrics nobody subscribed to are never worked out
+        if self.metrics.subscriptions:
+            self.metrics.observe(self.current_step, move_info)
 
         self.current_step += 1
 
         return move_info
 
-    def move_people(self):
+    def move_people(self, movers: List[List[Person]] = None, profile: StepProfile = None):
         base_moving_cost = 50
-        total_number_people_moved = 0
-        total_number_want_moved = 0
 
         # Initialize Market
         current_market = MovingMarket(base_moving_cost)
 
         # Initialize Demand Objects
         for town in self.towns:
-            current_market.town_demand.append(TownDemand(town))
+            current_market.add_town(town)
 
         # Initialize Moving Groups
+        if movers is None:
+            movers = [town.get_movers(self.happiness_cache) for town in self.towns]
+
         moving_groups: List[MovingGroup] = []
-        for town in self.towns:
-            moving_groups.append(MovingGroup(town, town.get_movers()))
+        for town, town_movers in zip(self.towns, movers):
+            moving_groups.append(MovingGroup(town, town_movers))
+
+        if profile is not None:
+            # The object market modes score movers through the shared cache, the array one counts its own batches
+            lookups_before = self.happiness_cache.hits + self.happiness_cache.misses
+
+        if self.cohort_backed or (self.towns and self.towns[0].array_backed):
+            move_info = self._move_people_arrays_(current_market, moving_groups, profile)
+        elif self.bucket_destinations:
+            move_info = self._move_people_bucketed_(current_market, moving_groups, profile)
+        elif self.group_movers:
+            move_info = self._move_people_grouped_(current_market, moving_groups, profile)
+        else:
+            move_info = self._move_people_each_(current_market, moving_groups, profile)
+
+        if profile is not None:
+            profile.happiness_evaluations += self.happiness_cache.hits + self.happiness_cache.misses - lookups_before
+
+        # Kept for a single step, holding on to it would cost a score per resident per platform
+        self.happiness_cache.clear()
+
+        return move_info
+
+    def _move_people_each_(self, current_market: MovingMarket, moving_groups: List[MovingGroup], profile: StepProfile = None):
+        """Look at every town for every mover."""
+        total_number_people_moved = 0
+        total_number_want_moved = 0
 
         # Set Town Demand and Loss
         for moving_group in moving_groups:
@@ -312,21 +986,26 @@ class World:
                 
                 # Count the people who want to come
                 for person in moving_group.people:
-                    if person.wants_to_move(moving_group.from_town.town_platform, td.town.town_platform):
+                    if person.wants_to_move(moving_group.from_town.town_platform, td.town.town_platform, self.happiness_cache):
                         td.num_people_want += 1
+
+        current_market.settle_costs()
+
+        if profile is not None:
+            profile.lap("demand")
                 
         # Move or Not
         for moving_group in moving_groups:
             other_towns = [town for town in self.towns if town != moving_group.from_town]
-            random.shuffle(other_towns)
+            self.rng.shuffle(other_towns)
 
             for person in moving_group.people:
                 person_moved = False
                 for town in other_towns:
-                    if person.wants_to_move(moving_group.from_town.town_platform, town.town_platform):
+                    if person.wants_to_move(moving_group.from_town.town_platform, town.town_platform, self.happiness_cache):
                         total_number_want_moved += 1
-                        if  person.money > current_market.get_town_moving_cost(town):
-                            moving_cost = current_market.get_town_moving_cost(town)
+                        moving_cost = current_market.get_town_moving_cost(town)
+                        if  person.money > moving_cost:
                             person.money -= moving_cost
                             town.town_bank += moving_cost
                             total_number_people_moved += 1
@@ -340,6 +1019,259 @@ class World:
 
         return WorldStepInfo(total_number_people_moved, total_number_want_moved, current_market)
 
+    def _classify_movers_(self, moving_group: MovingGroup):
+        from_town = moving_group.from_town
+        classes = {}
+        member_classes = []
+
+        for person in moving_group.people:
+            key = (person.preference_base_bits, person.unbendable_bitmask, person.basically_happy)
+            preference_class = classes.get(key)
+
+            if preference_class is None:
+                happinness_from = person.check_happiness(from_town.town_platform, self.happiness_cache) / person.preference_width
+                better_towns = [
+                    town for town in self.towns
+                    if town != from_town and person.check_happiness(town.town_platform, self.happiness_cache) / person.preference_width > happinness_from
+                ]
+                preference_class = classes[key] = PreferenceClass(happinness_from, better_towns)
+
+            # Only the threshold is personal
+            if preference_class.happinness_from < person.move_threshold:
+                preference_class.num_people_wanting += 1
+
+            member_classes.append(preference_class)
+
+        return classes.values(), member_classes
+
+    def _move_people_grouped_(self, current_market: MovingMarket, moving_groups: List[MovingGroup], profile: StepProfile = None):
+        total_number_people_moved = 0
+        total_number_want_moved = 0
+        group_classes = []
+
+        # Set Town Demand and Loss
+        for moving_group in moving_groups:
+            classes, member_classes = self._classify_movers_(moving_group)
+            group_classes.append((classes, member_classes))
+            current_market.demand_for(moving_group.from_town).num_people_leaving = len(moving_group.people)
+
+            for preference_class in classes:
+                for town in preference_class.better_towns:
+                    current_market.demand_for(town).num_people_want += preference_class.num_people_wanting
+
+        current_market.settle_costs()
+
+        if profile is not None:
+            profile.lap("demand")
+
+        # Move or Not
+        for moving_group, (classes, member_classes) in zip(moving_groups, group_classes):
+            other_towns = [town for town in self.towns if town != moving_group.from_town]
+            self.rng.shuffle(other_towns)
+            town_order = {town.id: order for order, town in enumerate(other_towns)}
+
+            # Try the better towns in the same shuffled order as everyone else
+            for preference_class in classes:
+                preference_class.better_towns.sort(key=lambda town: town_order[town.id])
+
+            for person, preference_class in zip(moving_group.people, member_classes):
+                person_moved = False
+
+                if preference_class.happinness_from < person.move_threshold:
+                    for town in preference_class.better_towns:
+                        total_number_want_moved += 1
+                        moving_cost = current_market.get_town_moving_cost(town)
+
+                        if person.money > moving_cost:
+                            person.money -= moving_cost
+                            town.town_bank += moving_cost
+                            total_number_people_moved += 1
+                            town.people.append(person)
+                            person_moved = True
+                            break
+
+                # If we couldn't move them... well they stay then
+                if not person_moved:
+                    moving_group.from_town.people.append(person)
+
+        return WorldStepInfo(total_number_people_moved, total_number_want_moved, current_market)
+
+    def _better_platforms_(self, person: Person, from_platform: int):
+        """Happiness where the mover is now, and the platform buckets that would beat it."""
+        happinness_from = person.check_happiness(from_platform, self.happiness_cache) / person.preference_width
+
+        if happinness_from >= person.move_threshold:
+            return happinness_from, ()
+
+        better_platforms = tuple(
+            platform for platform in self.platform_index
+            if person.check_happiness(platform, self.happiness_cache) / person.preference_width > happinness_from
+        )
+
+        return happinness_from, better_platforms
+
+    def _draws_until_affordable_(self, num_candidates: int, num_affordable: int):
+        """How many towns a mover looks at, in random order, before the first one they can afford."""
+        draws = 1
+        remaining = num_candidates
+
+        while self.rng.random() * remaining >= num_affordable:
+            draws += 1
+            remaining -= 1
+
+        return draws
+
+    def _move_people_bucketed_(self, current_market: MovingMarket, moving_groups: List[MovingGroup], profile: StepProfile = None):
+        """Move people by platform bucket instead of looking at every town for every mover.
+
+        Scanning shuffled towns and taking the first affordable better one
+        lands a mover in a uniformly random affordable candidate, after
+        looking at a negative hypergeometric number of towns. Both are drawn
+        directly here, per mover rather than from one shuffle shared by
+        everyone leaving the same town.
+        """
+        total_number_people_moved = 0
+        total_number_want_moved = 0
+        bucket_demand = {platform: 0 for platform in self.platform_index}
+        group_choices = []
+
+        # Set Town Demand and Loss
+        for moving_group in moving_groups:
+            current_market.demand_for(moving_group.from_town).num_people_leaving = len(moving_group.people)
+            choices = []
+
+            for person in moving_group.people:
+                _, better_platforms = self._better_platforms_(person, moving_group.from_town.town_platform)
+                choices.append(better_platforms)
+
+                for platform in better_platforms:
+                    bucket_demand[platform] += 1
+
+            group_choices.append(choices)
+
+        for platform, num_people_want in bucket_demand.items():
+            for town in self.platform_index[platform]:
+                current_market.demand_for(town).num_people_want += num_people_want
+
+        current_market.settle_costs()
+
+        if profile is not None:
+            profile.lap("demand")
+
+        # Everyone wanting the same buckets shares a cost sorted candidate list
+        candidates = {}
+
+        # Move or Not
+        for moving_group, choices in zip(moving_groups, group_choices):
+            for person, better_platforms in zip(moving_group.people, choices):
+                person_moved = False
+
+                if better_platforms:
+                    if better_platforms not in candidates:
+                        towns = [town for platform in better_platforms for town in self.platform_index[platform]]
+                        towns.sort(key=current_market.get_town_moving_cost)
+                        candidates[better_platforms] = CandidateTowns(towns, [current_market.get_town_moving_cost(town) for town in towns])
+
+                    candidate_towns = candidates[better_platforms]
+                    num_affordable = candidate_towns.num_affordable(person.money)
+
+                    if num_affordable:
+                        total_number_want_moved += self._draws_until_affordable_(len(candidate_towns.towns), num_affordable)
+                        chosen = self.rng.randrange(num_affordable)
+                        town = candidate_towns.towns[chosen]
+                        moving_cost = candidate_towns.costs[chosen]
+                        person.money -= moving_cost
+                        town.town_bank += moving_cost
+                        total_number_people_moved += 1
+                        town.people.append(person)
+                        person_moved = True
+                    else:
+                        total_number_want_moved += len(candidate_towns.towns)
+
+                # If we couldn't move them... well they stay then
+                if not person_moved:
+                    moving_group.from_town.people.append(person)
+
+        return WorldStepInfo(total_number_people_moved, total_number_want_moved, current_market)
+
+    def _move_people_arrays_(self, current_market: MovingMarket, moving_groups: List[MovingGroup], profile: StepProfile = None):
+        """_move_people_each_ for array and cohort backed towns, every row of a group at once.
+
+        Rows are scored against every other town in one batch, and land in
+        the same towns in the same order as the per mover loop would put them.
+        A cohort row moves as one, everyone in it holding its average money.
+        Bucketing and grouping only speed up the object loops, so array backed
+        worlds always come here.
+        """
+        import numpy as np
+
+        total_number_people_moved = 0
+        total_number_want_moved = 0
+        group_wants = []
+
+        # Set Town Demand and Loss
+        for moving_group in moving_groups:
+            movers = moving_group.people
+            other_towns = [town for town in self.towns if town != moving_group.from_town]
+            current_market.demand_for(moving_group.from_town).num_people_leaving = len(movers)
+
+            # Which of the other towns each row would rather live in, a row per town
+            happinness_from = movers.check_happiness(moving_group.from_town.town_platform) / movers.preference_width
+            happinness_to = movers.check_happiness([town.town_platform for town in other_towns]).reshape(len(other_towns), movers.size) / movers.preference_width
+            wants = (happinness_from < movers.move_threshold)[np.newaxis, :] & (happinness_to > happinness_from[np.newaxis, :])
+
+            for town, num_people_want in zip(other_towns, (wants @ movers.counts).tolist()):
+                current_market.demand_for(town).num_people_want += num_people_want
+
+            group_wants.append(wants)
+
+            if profile is not None:
+                # Every row against its own town and each of the others
+                profile.happiness_evaluations += movers.size * (1 + len(other_towns))
+
+        current_market.settle_costs()
+
+        if profile is not None:
+            profile.lap("demand")
+
+        # Move or Not
+        for moving_group, wants in zip(moving_groups, group_wants):
+            movers = moving_group.people
+            other_towns = [town for town in self.towns if town != moving_group.from_town]
+            # Shuffled the same way as _move_people_each_ so the market stream is drawn from alike
+            order = list(range(len(other_towns)))
+            self.rng.shuffle(order)
+
+            if other_towns and movers.size:
+                wants = wants[order]
+                costs = np.array([current_market.get_town_moving_cost(other_towns[index]) for index in order])
+                affordable = wants & (movers.average_money[np.newaxis, :] > costs[:, np.newaxis])
+                moves = affordable.any(axis=0)
+                choices = np.where(moves, affordable.argmax(axis=0), -1)
+
+                # Rows look at every town they want up to the one they move to, or all of them
+                looked_at = np.where(moves, np.cumsum(wants, axis=0)[np.maximum(choices, 0), np.arange(movers.size)], wants.sum(axis=0))
+                total_number_want_moved += int(looked_at @ movers.counts)
+
+                for position, index in enumerate(order):
+                    chosen = choices == position
+
+                    if not chosen.any():
+                        continue
+
+                    town = other_towns[index]
+                    moving = movers.take(chosen)
+                    choices = choices[~chosen]
+                    moving.adjust_money(-costs[position] * moving.counts)
+                    town.town_bank += costs[position] * len(moving)
+                    total_number_people_moved += len(moving)
+                    town.people.extend_population(moving)
+
+            # If we couldn't move them... well they stay then
+            moving_group.from_town.people.extend_population(movers)
+
+        return WorldStepInfo(total_number_people_moved, total_number_want_moved, current_market)
+
     def __str__(self):
         ret_str = "WORLD STATS:\n"
 
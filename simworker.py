@@ -0,0 +1,96 @@
+##
+#   Runs a World on a background thread so the simulation isn't tied to the
+#   UI's frame rate. The worker subscribes to the metrics the graphs plot and
+#   the UI drains them as one batch whenever it redraws. Once queue_size
+#   samples are waiting the worker holds off, so nothing is dropped if
+#   drawing falls behind.
+##
+
+import threading
+import time
+
+from simulationobjects import World
+
+
+# What the graphs plot, the world's StepProfile is added when it's profiling
+GRAPH_METRICS = ("population", "total_wealth", "moving_cost", "people_moved", "people_desire_moved")
+
+
+class SimulationWorker:
+    def __init__(self, world: World, queue_size: int = 1000, target_steps_per_second: float = None, every: int = 1):
+        self.world = world
+        self.queue_size = queue_size
+        # The graphs get a point every this many steps
+        self.subscription = world.metrics.subscribe(GRAPH_METRICS + (("profile",) if world.profile else ()), every)
+        # None runs as fast as possible
+        self.target_steps_per_second = target_steps_per_second
+        self.steps_per_second = 0
+
+        self._thread = None
+        self._running = threading.Event()
+        self._stopped = threading.Event()
+
+    @property
+    def started(self):
+        return self._thread is not None
+
+    @property
+    def paused(self):
+        return self.started and not self._running.is_set()
+
+    def start(self):
+        if self.started:
+            self.resume()
+            return
+
+        self._running.set()
+        self._thread = threading.Thread(target=self._run_, name="SimulationWorker", daemon=True)
+        self._thread.start()
+
+    def pause(self):
+        self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    def stop(self, timeout: float = 1):
+        self._stopped.set()
+        # Wake the thread up if it's waiting so it can see it should stop
+        self._running.set()
+
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def drain(self):
+        """Every sample taken since the last drain as one metrics batch, oldest first."""
+        return self.subscription.drain()
+
+    def _wait_for_drain_(self):
+        while self.subscription.pending >= self.queue_size and not self._stopped.is_set():
+            self._stopped.wait(0.01)
+
+    def _run_(self):
+        last_step_time = time.perf_counter()
+
+        while not self._stopped.is_set():
+            if not self._running.is_set():
+                self._running.wait()
+                # Time spent paused shouldn't count against the step rate
+                last_step_time = time.perf_counter()
+
+            if self._stopped.is_set():
+                break
+
+            self.world.step_world()
+            self._wait_for_drain_()
+
+            if self.target_steps_per_second:
+                time.sleep(max(0, (1 / self.target_steps_per_second) - (time.perf_counter() - last_step_time)))
+
+            now = time.perf_counter()
+            elapsed = now - last_step_time
+            last_step_time = now
+
+            # Smooth it out so the readout doesn't jitter
+            if elapsed > 0:
+                self.steps_per_second = 0.7 * self.steps_per_second + 0.3 * (1 / elapsed)
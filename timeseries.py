@@ -0,0 +1,173 @@
+##
+#   Time series buffer for the graphs. Keeps its values in a growable NumPy
+#   array with running min/max, can keep only the most recent window of
+#   points, and downsamples with Largest-Triangle-Three-Buckets so a plot is
+#   never sent many more points than it has pixels.
+##
+
+from collections import deque
+
+import numpy as np
+
+
+def lttb(xs: np.ndarray, ys: np.ndarray, threshold: int):
+    """Largest-Triangle-Three-Buckets downsample of (xs, ys) to threshold points.
+
+    Keeps the first and last point and, from every bucket in between, the
+    point making the largest triangle with the previously kept point and the
+    average of the next bucket, which holds on to peaks and troughs.
+    """
+    length = len(ys)
+
+    if threshold >= length or threshold < 3:
+        return list(zip(xs.tolist(), ys.tolist()))
+
+    sampled = [(xs[0], ys[0])]
+    bucket_size = (length - 2) / (threshold - 2)
+    previous = 0
+
+    for bucket in range(threshold - 2):
+        range_start = int(bucket * bucket_size) + 1
+        range_end = int((bucket + 1) * bucket_size) + 1
+        next_start = range_end
+        next_end = min(int((bucket + 2) * bucket_size) + 1, length)
+
+        average_x = xs[next_start:next_end].mean()
+        average_y = ys[next_start:next_end].mean()
+        previous_x = xs[previous]
+        previous_y = ys[previous]
+
+        areas = np.abs(
+            (previous_x - average_x) * (ys[range_start:range_end] - previous_y)
+            - (previous_x - xs[range_start:range_end]) * (average_y - previous_y)
+        )
+        previous = range_start + int(areas.argmax())
+        sampled.append((xs[previous], ys[previous]))
+
+    sampled.append((xs[-1], ys[-1]))
+
+    return [(float(x), float(y)) for x, y in sampled]
+
+
+class TimeSeries:
+    """One value per step. Set window to only keep the most recent steps."""
+
+    def __init__(self, window: int = None, capacity: int = 1024):
+        self.window = window
+        self._values = np.empty(max(capacity, 2 * (window or 0)), dtype=np.float64)
+        self._start = 0
+        self._end = 0
+        # Step number of the first value still kept
+        self.first_x = 0
+
+        # Whole history min/max are plain running values, a window needs
+        # monotonic deques of (x, value) candidates instead
+        self._min = float("inf")
+        self._max = float("-inf")
+        self._min_candidates = deque()
+        self._max_candidates = deque()
+
+    def __len__(self):
+        return self._end - self._start
+
+    @property
+    def last_x(self):
+        return self.first_x + len(self) - 1
+
+    @property
+    def values(self):
+        return self._values[self._start:self._end]
+
+    @property
+    def min(self):
+        if not len(self):
+            return 0
+
+        return self._min_candidates[0][1] if self.window else self._min
+
+    @property
+    def max(self):
+        if not len(self):
+            return 0
+
+        return self._max_candidates[0][1] if self.window else self._max
+
+    def _make_room_(self):
+        if self._end < len(self._values):
+            return
+
+        kept = self.values.copy()
+
+        # Slide the window back to the front if that frees enough, otherwise grow
+        if len(kept) * 2 > len(self._values):
+            self._values = np.empty(len(self._values) * 2, dtype=np.float64)
+
+        self._values[:len(kept)] = kept
+        self._start = 0
+        self._end = len(kept)
+
+    def append(self, value: float):
+        self._make_room_()
+        x = self.first_x + len(self)
+        self._values[self._end] = value
+        self._end += 1
+
+        if not self.window:
+            self._min = min(self._min, value)
+            self._max = max(self._max, value)
+            return
+
+        while self._min_candidates and self._min_candidates[-1][1] >= value:
+            self._min_candidates.pop()
+        self._min_candidates.append((x, value))
+
+        while self._max_candidates and self._max_candidates[-1][1] <= value:
+            self._max_candidates.pop()
+        self._max_candidates.append((x, value))
+
+        if len(self) > self.window:
+            self._start += 1
+            self.first_x += 1
+
+            if self._min_candidates[0][0] < self.first_x:
+                self._min_candidates.popleft()
+            if self._max_candidates[0][0] < self.first_x:
+                self._max_candidates.popleft()
+
+    def extend(self, values):
+        """append() every value, copied in as one block when keeping the whole history."""
+        values = np.asarray(values, dtype=np.float64)
+
+        if self.window:
+            for value in values.tolist():
+                self.append(value)
+            return
+
+        if not len(values):
+            return
+
+        if self._end + len(values) > len(self._values):
+            kept = self.values.copy()
+            capacity = len(self._values)
+
+            while capacity < len(kept) + len(values):
+                capacity *= 2
+
+            self._values = np.empty(capacity, dtype=np.float64)
+            self._values[:len(kept)] = kept
+            self._start = 0
+            self._end = len(kept)
+
+        self._values[self._end:self._end + len(values)] = values
+        self._end += len(values)
+        self._min = min(self._min, float(values.min()))
+        self._max = max(self._max, float(values.max()))
+
+    def points(self, max_points: int = None):
+        """(step, value) pairs to plot, downsampled to at most max_points."""
+        xs = np.arange(self.first_x, self.first_x + len(self), dtype=np.float64)
+
+        if max_points is None:
+            return list(zip(xs.tolist(), self.values.tolist()))
+
+        return lttb(xs, self.values, max_points)
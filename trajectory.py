@@ -0,0 +1,224 @@
+##
+#   Trajectory log. Records per step, per town metrics of a run into a
+#   directory holding one flat binary file per column, appended a chunk of
+#   steps at a time. Reading maps the column files straight into memory, so
+#   runs of millions of steps can be analysed without loading them, and a
+#   recorded run can be replayed into the UI graphs without re-simulating.
+##
+
+import json
+import os
+import time
+
+import numpy as np
+
+from happiness import pack_words, words_for
+from simulationobjects import World
+
+
+FORMAT_VERSION = 1
+
+# One value per town per step, stored as (steps, towns), except platform
+# which is (steps, towns, words) of packed 64 bit words when wider than 64
+TOWN_COLUMNS = {
+    "population": np.int64,
+    "total_wealth": np.float64,
+    "town_bank": np.float64,
+    "platform": np.uint64,
+    "moving_cost": np.float64,
+    "people_leaving": np.int64,
+    "people_wanting": np.int64,
+}
+
+# One value per step
+STEP_COLUMNS = {
+    "step": np.int64,
+    "people_moved": np.int64,
+    "people_desire_moved": np.int64,
+}
+
+
+def _column_path(path: str, name: str):
+    return os.path.join(path, f"{name}.bin")
+
+
+class TrajectoryRecorder:
+    def __init__(self, path: str, num_towns: int, chunk_steps: int = 1024, platform_width: int = 64):
+        if os.path.exists(os.path.join(path, "header.json")):
+            raise FileExistsError(f"{path} already holds a trajectory")
+
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.num_towns = num_towns
+        # Steps of metrics batched up per write
+        self.chunk_steps = chunk_steps
+        self.steps_written = 0
+        self.platform_words = words_for(platform_width)
+        self.subscription = None
+
+        header = {
+            "version": FORMAT_VERSION,
+            "num_towns": num_towns,
+            "platform_words": self.platform_words,
+            "town_columns": {name: np.dtype(dtype).str for name, dtype in TOWN_COLUMNS.items()},
+            "step_columns": {name: np.dtype(dtype).str for name, dtype in STEP_COLUMNS.items()},
+        }
+
+        with open(os.path.join(path, "header.json"), "w") as header_file:
+            json.dump(header, header_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def attach(self, world: World):
+        """Record every step world takes from now on, a chunk_steps batch of metrics at a time."""
+        names = [name for name in list(TOWN_COLUMNS) + list(STEP_COLUMNS) if name != "step"]
+        self.subscription = world.metrics.subscribe(names, callback=self.record_batch, batch_size=self.chunk_steps)
+
+    def record_batch(self, batch: dict):
+        """Append a metrics batch holding every column to the column files."""
+        steps = len(batch["step"])
+
+        if not steps:
+            return
+
+        columns = {name: batch[name].astype(dtype) for name, dtype in list(TOWN_COLUMNS.items()) + list(STEP_COLUMNS.items()) if name != "platform"}
+        platforms = batch["platform"].ravel().tolist()
+
+        if self.platform_words > 1:
+            columns["platform"] = pack_words(platforms, self.platform_words).reshape(steps, self.num_towns, self.platform_words)
+        else:
+            columns["platform"] = np.array(platforms, dtype=np.uint64).reshape(steps, self.num_towns)
+
+        for name, column in columns.items():
+            with open(_column_path(self.path, name), "ab") as column_file:
+                column_file.write(np.ascontiguousarray(column).tobytes())
+
+        self.steps_written += steps
+
+    def close(self):
+        """Stop recording, writing out whatever is still batched up."""
+        if self.subscription is not None:
+            self.subscription.close()
+            self.subscription = None
+
+
+class TrajectoryReader:
+    """Memory mapped, read only view of a recorded trajectory."""
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "header.json")) as header_file:
+            header = json.load(header_file)
+
+        if header["version"] != FORMAT_VERSION:
+            raise ValueError(f"Trajectory format version {header['version']} is not supported, expected {FORMAT_VERSION}")
+
+        self.path = path
+        self.num_towns = header["num_towns"]
+        self.platform_words = header.get("platform_words", 1)
+        self.columns = {}
+        sizes = {}
+        town_shapes = {name: (self.num_towns,) for name in header["town_columns"]}
+
+        if self.platform_words > 1:
+            town_shapes["platform"] = (self.num_towns, self.platform_words)
+
+        for name, dtype in header["town_columns"].items():
+            sizes[name] = self._steps_in_file_(name, np.dtype(dtype).itemsize * int(np.prod(town_shapes[name])))
+        for name, dtype in header["step_columns"].items():
+            sizes[name] = self._steps_in_file_(name, np.dtype(dtype).itemsize)
+
+        # A run cut off mid flush can leave some columns a chunk ahead
+        self.steps = min(sizes.values()) if sizes else 0
+
+        for name, dtype in header["town_columns"].items():
+            self.columns[name] = self._map_(name, dtype, (self.steps,) + town_shapes[name])
+        for name, dtype in header["step_columns"].items():
+            self.columns[name] = self._map_(name, dtype, (self.steps,))
+
+    def _steps_in_file_(self, name: str, bytes_per_step: int):
+        column_path = _column_path(self.path, name)
+
+        return os.path.getsize(column_path) // bytes_per_step if os.path.exists(column_path) else 0
+
+    def _map_(self, name: str, dtype: str, shape: tuple):
+        if not self.steps:
+            return np.zeros(shape, dtype=dtype)
+
+        return np.memmap(_column_path(self.path, name), dtype=dtype, mode="r", shape=shape)
+
+    def __len__(self):
+        return self.steps
+
+    def __getitem__(self, name: str):
+        return self.columns[name]
+
+    def batch(self, start: int, stop: int):
+        """Steps start to stop laid out like a metrics Subscription batch."""
+        return {name: np.array(column[start:stop]) for name, column in self.columns.items()}
+
+
+class TrajectoryReplay:
+    """Feeds a recorded run to the UI the same way SimulationWorker feeds a live one."""
+
+    def __init__(self, reader: TrajectoryReader, target_steps_per_second: float = None, max_drain: int = 1000):
+        self.reader = reader
+        # None replays as fast as the UI drains, max_drain steps at a time
+        self.target_steps_per_second = target_steps_per_second
+        self.max_drain = max_drain
+        self.steps_per_second = 0
+        self.position = 0
+
+        self._started = False
+        self._running = False
+        self._last_drain_time = None
+        self._owed_steps = 0
+
+    @property
+    def started(self):
+        return self._started
+
+    @property
+    def paused(self):
+        return self._started and not self._running
+
+    def start(self):
+        self._started = True
+        self.resume()
+
+    def pause(self):
+        self._running = False
+
+    def resume(self):
+        self._running = True
+        self._last_drain_time = time.perf_counter()
+
+    def stop(self, timeout: float = None):
+        self._running = False
+
+    def drain(self, max_steps: int = None):
+        if not self._running or self.position >= len(self.reader):
+            self.steps_per_second = 0
+            return self.reader.batch(0, 0)
+
+        now = time.perf_counter()
+        elapsed = now - self._last_drain_time
+        self._last_drain_time = now
+        count = self.max_drain if max_steps is None else min(max_steps, self.max_drain)
+
+        if self.target_steps_per_second:
+            self._owed_steps += elapsed * self.target_steps_per_second
+            count = min(count, int(self._owed_steps))
+            self._owed_steps -= count
+
+        count = min(count, len(self.reader) - self.position)
+        batch = self.reader.batch(self.position, self.position + count)
+        self.position += count
+
+        if elapsed > 0:
+            self.steps_per_second = count / elapsed
+
+        return batch